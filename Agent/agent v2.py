@@ -1,5 +1,9 @@
 import gym
 import numpy as np
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from policystore import BASIC_AXES, save_policy
 
 class ValueIterationAgent:
     def __init__(self, gamma=1.0, theta=0.0001):
@@ -86,5 +90,6 @@ agent.value_iteration(env)
 print("Learned Policy:")
 print(agent.policy)
 
-np.save('learnedpolicy.npy', agent.policy)
+rules = {"natural": False, "sab": False, "hit_soft_17": False}
+save_policy('learnedpolicy.npy', agent.policy, BASIC_AXES, [0, 0, 0], rules)
 
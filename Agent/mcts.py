@@ -1,123 +1,275 @@
-import gym
 import numpy as np
 import random
-from math import sqrt, log
+from math import sqrt, log, erf
+from collections import namedtuple
+import os
+import sys
+import time
+from multiprocessing import Pool
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from blackjack import BlackjackEnv
+from policystore import BASIC_AXES, save_policy
+
+# Result of a deadline-bounded search: confidence is the estimated probability
+# that the chosen action really has the higher expected reward
+Decision = namedtuple("Decision", ["action", "iterations", "confidence", "values", "elapsed_ms"])
 
 class MCTSAgent:
-    def __init__(self, num_iterations=1000, exploration_constant=1.41):
+    def __init__(self, num_iterations=1000, exploration_constant=1.41, time_budget_ms=None):
         self.num_iterations = num_iterations
         self.exploration_constant = exploration_constant
+        # With a time budget the search is anytime: it stops at whichever of
+        # num_iterations (None for no limit) or the deadline comes first
+        self.time_budget_ms = time_budget_ms
+        self.table = {}
+        self.iterations = 0
 
     def select_action(self, env):
-        initial_observation = env.reset()
-        root = Node(state=GameState(initial_observation, env), parent=None, untried_actions=list(range(env.action_space.n)))
-        for _ in range(self.num_iterations):
-            node = self.select_node(root)
-            reward = self.rollout(env, node.state)
-            self.backpropagate(node, reward)
-        return self.best_action(root)
-
-    def select_node(self, node):
-        while not node.is_terminal():
-            if node.is_fully_expanded():
-                node = node.best_child(self.exploration_constant)
-            else:
-                return node.expand()
+        return self.best_action(self.search(env))
+
+    def decide(self, env, time_budget_ms=None):
+        if time_budget_ms is None:
+            time_budget_ms = self.time_budget_ms
+        start = time.perf_counter()
+        root = self.search(env, time_budget_ms)
+        action = self.best_action(root)
+        values = [root.mean_value(a) if root.action_visits[a] else None for a in (0, 1)]
+        return Decision(action, self.iterations, root.confidence(action), values,
+                        (time.perf_counter() - start) * 1000)
+
+    def search(self, env, time_budget_ms=None):
+        # Search from the env's current hand. Every iteration restores that exact
+        # state and redeals the cards the player can't see, so the live game and
+        # its shoe are left untouched.
+        # Nodes live in a transposition table keyed by observation, so the same
+        # (player sum, dealer card, usable ace, temperature) reached by different
+        # draws shares one set of statistics.
+        if time_budget_ms is None:
+            time_budget_ms = self.time_budget_ms
+        deadline = float('inf') if time_budget_ms is None else time.perf_counter() + time_budget_ms / 1000
+        num_iterations = float('inf') if self.num_iterations is None else self.num_iterations
+        self.table = {}
+        self.iterations = 0
+        root_state = env.snapshot()
+        root = self.node(observe(env))
+        # Always complete two iterations so both root actions have been tried
+        while self.iterations < 2 or (self.iterations < num_iterations and time.perf_counter() < deadline):
+            self.iterations += 1
+            env.restore(root_state, rng=False)
+            env.resample_hidden()
+            path, done, reward = self.select_path(env, root)
+            if not done:
+                reward = self.rollout(env)
+            self.backpropagate(path, reward)
+        env.restore(root_state)
+        return root
+
+    def node(self, observation):
+        node = self.table.get(observation)
+        if node is None:
+            node = self.table[observation] = Node()
         return node
 
-    def rollout(self, env, state):
-        while not state.is_terminal():
-            action = random.choice(state.available_actions())
-            state = state.take_action(action)
-        return state.get_reward()
+    def select_path(self, env, node):
+        # Walk the graph by stepping the env; returns the (node, action) pairs taken
+        # and the outcome of the last step
+        path = []
+        while True:
+            action = node.untried_action()
+            expanded = action is not None
+            if not expanded:
+                action = node.best_action(self.exploration_constant)
+            path.append((node, action))
+            observation, reward, terminated, truncated, _ = env.step(action)
+            done = terminated or truncated
+            if done:
+                return path, done, reward
+            node = self.table.get(observation)
+            if node is None:
+                self.table[observation] = Node()
+                return path, done, reward
+            if expanded:
+                return path, done, reward
 
-    def backpropagate(self, node, reward):
-        while node is not None:
+    def rollout(self, env):
+        while True:
+            action = random.choice([0, 1])
+            _, reward, terminated, truncated, _ = env.step(action)
+            if terminated or truncated:
+                return reward
+
+    def backpropagate(self, path, reward):
+        for node, action in path:
             node.visits += 1
-            node.value += reward
-            node = node.parent
+            node.action_visits[action] += 1
+            node.action_values[action] += reward
+            node.action_squares[action] += reward * reward
 
     def best_action(self, node):
-        return max(node.children, key=lambda n: n.value / n.visits if n.visits > 0 else 0).action
+        return max(
+            (action for action in (0, 1) if node.action_visits[action] > 0),
+            key=node.mean_value,
+        )
+
+def observe(env):
+    return (*env._get_obs(), env.deck.calc_temperature())
 
 class Node:
-    def __init__(self, state, parent, untried_actions, action=None):
-        self.state = state
-        self.parent = parent
-        self.untried_actions = untried_actions
-        self.action = action
-        self.children = []
-        self.value = 0
+    # One node per observation; statistics are kept per action (edge) so that
+    # paths meeting at the same observation share them
+    __slots__ = ("visits", "action_visits", "action_values", "action_squares")
+
+    def __init__(self):
         self.visits = 0
+        self.action_visits = [0, 0]
+        self.action_values = [0.0, 0.0]
+        self.action_squares = [0.0, 0.0]
+
+    def untried_action(self):
+        for action in (1, 0):
+            if self.action_visits[action] == 0:
+                return action
+        return None
 
-    def expand(self):
-        action = self.untried_actions.pop()
-        next_state = self.state.take_action(action)
-        child_node = Node(state=next_state, parent=self, untried_actions=next_state.available_actions(), action=action)
-        self.children.append(child_node)
-        return child_node
+    def mean_value(self, action):
+        return self.action_values[action] / self.action_visits[action]
 
-    def is_fully_expanded(self):
-        return len(self.untried_actions) == 0
+    def confidence(self, action):
+        # Normal approximation of P(action's mean reward > the other action's)
+        other = 1 - action
+        if self.action_visits[other] == 0:
+            return 1.0
+        variance = 0.0
+        for a in (action, other):
+            n = self.action_visits[a]
+            mean = self.mean_value(a)
+            variance += max(self.action_squares[a] / n - mean * mean, 0.0) / n
+        difference = self.mean_value(action) - self.mean_value(other)
+        if variance == 0.0:
+            return 1.0 if difference > 0 else 0.5
+        return 0.5 * (1 + erf(difference / sqrt(2 * variance)))
 
-    def best_child(self, exploration_constant):
+    def best_action(self, exploration_constant):
         best_score = float('-inf')
-        best_children = []
-        for child in self.children:
-            exploit = child.value / child.visits
-            explore = sqrt(2 * log(self.visits) / child.visits)
+        best_actions = []
+        for action in (0, 1):
+            exploit = self.mean_value(action)
+            explore = sqrt(2 * log(self.visits) / self.action_visits[action])
             score = exploit + exploration_constant * explore
             if score == best_score:
-                best_children.append(child)
+                best_actions.append(action)
             elif score > best_score:
-                best_children = [child]
+                best_actions = [action]
                 best_score = score
-        return random.choice(best_children)
+        return random.choice(best_actions)
 
-    def is_terminal(self):
-        return self.state.is_terminal()
+def hands_for_state(player_sum, dealer_card, usable_ace):
+    # A starting (player, dealer upcard) deal with this observation, or None if no hand reaches it.
+    # Cards are dealt as BlackjackEnv deals them, aces as 11 (dealer_card 1 is an ace), so
+    # the env never holds a usable ace and those states are unreachable.
+    if usable_ace or not 4 <= player_sum <= 21:
+        return None
+    player = []
+    remaining = player_sum
+    while remaining > 10 or not player:
+        card = min(10, remaining - 2)
+        player.append(card)
+        remaining -= card
+    player.append(remaining)
+    return player, [11 if dealer_card == 1 else dealer_card]
 
-class GameState:
-    def __init__(self, observation, env, done=False, reward=0):
-        self.observation = observation
-        self.env = env
-        self.done = done
-        self.reward = reward
-
-    def take_action(self, action):
-        results = self.env.step(action)
-        observation, reward, done = results[:3]
-        return GameState(observation, self.env, done, reward)
+def run_mcts_on_state(env, agent, state, seed=None):
+    hands = hands_for_state(*state)
+    if hands is None:
+        return 0
+    player, dealer = hands
+    env.reset(seed=seed, options={"player": player, "dealer": dealer})
+    return agent.select_action(env)
 
-    def available_actions(self):
-        return [0, 1] if not self.done else []
+def search_root(task):
+    # One independent search of a state, run in a worker process
+    state, num_iterations, exploration_constant, seed = task
+    start = time.perf_counter()
+    random.seed(seed)
+    player, dealer = hands_for_state(*state)
+    env = BlackjackEnv()
+    env.reset(seed=seed, options={"player": player, "dealer": dealer})
+    root = MCTSAgent(num_iterations, exploration_constant).search(env)
+    stats = {
+        action: (root.action_visits[action], root.action_values[action])
+        for action in (0, 1)
+        if root.action_visits[action] > 0
+    }
+    return state, stats, time.perf_counter() - start
 
-    def is_terminal(self):
-        return self.done
+def parallel_sweep(num_iterations=1000, num_roots=4, num_workers=None, seed=0, exploration_constant=1.41):
+    # Root-parallel MCTS over the whole policy grid: each reachable state is searched
+    # num_roots times independently across a process pool, and the roots' visit
+    # counts and values are merged per action as they finish
+    states = [
+        (player_sum, dealer_card, usable_ace)
+        for player_sum in range(1, 32)
+        for dealer_card in range(1, 11)
+        for usable_ace in (0, 1)
+        if hands_for_state(player_sum, dealer_card, usable_ace) is not None
+    ]
+    seeds = np.random.SeedSequence(seed).spawn(len(states) * num_roots)
+    tasks = [
+        (state, num_iterations, exploration_constant, int(seeds[i * num_roots + root].generate_state(1)[0]))
+        for i, state in enumerate(states)
+        for root in range(num_roots)
+    ]
 
-    def get_reward(self):
-        return self.reward
+    best_actions = np.zeros((32, 11, 2), dtype=int)
+    merged = {state: {} for state in states}
+    pending = {state: num_roots for state in states}
+    search_time = {state: 0.0 for state in states}
+    with Pool(num_workers) as pool:
+        for state, stats, elapsed in pool.imap_unordered(search_root, tasks):
+            for action, (visits, value) in stats.items():
+                total_visits, total_value = merged[state].get(action, (0, 0.0))
+                merged[state][action] = (total_visits + visits, total_value + value)
+            search_time[state] += elapsed
+            pending[state] -= 1
+            if pending[state] == 0:
+                action_values = {action: value / visits for action, (visits, value) in merged[state].items()}
+                best_action = max(action_values, key=action_values.get)
+                player_sum, dealer_card, usable_ace = state
+                best_actions[player_sum - 1][dealer_card - 1][usable_ace] = best_action
+                print(f"{state}: {best_action} {action_values} ({search_time[state]:.2f}s search)")
+    return best_actions, search_time
 
-def run_mcts_on_state(env, agent, state):
-    env.reset()
-    env.s = state
-    return agent.select_action(env)
+def decide_live(deck_tracker, player, dealer_card, time_budget_ms=50, agent=None):
+    # Decide for a live hand within time_budget_ms, searching over the cards an
+    # irl_blackjack.DeckTracker still holds (player and dealer cards already dealt)
+    if agent is None:
+        agent = MCTSAgent(num_iterations=None)
+    env = BlackjackEnv()
+    env.reset(options={"cards": deck_tracker.cards, "player": player, "dealer": [dealer_card]})
+    return agent.decide(env, time_budget_ms)
 
-def main():
-    env = gym.make('Blackjack-v1')
+def main(parallel=True):
+    env = BlackjackEnv()
     agent = MCTSAgent()
 
-    best_actions = np.zeros((32, 11, 2), dtype=int)
+    if parallel:
+        best_actions, _ = parallel_sweep(agent.num_iterations, exploration_constant=agent.exploration_constant)
+    else:
+        best_actions = np.zeros((32, 11, 2), dtype=int)
 
-    for player_sum in range(1, 32):
-        for dealer_card in range(1, 11):
-            for usable_ace in (0, 1):
-                state = (player_sum, dealer_card, usable_ace)
-                
-                best_action = run_mcts_on_state(env, agent, state)
-                best_actions[player_sum - 1][dealer_card - 1][usable_ace] = best_action
+        for player_sum in range(1, 32):
+            for dealer_card in range(1, 11):
+                for usable_ace in (0, 1):
+                    state = (player_sum, dealer_card, usable_ace)
+
+                    best_action = run_mcts_on_state(env, agent, state)
+                    best_actions[player_sum - 1][dealer_card - 1][usable_ace] = best_action
 
-    np.save('best_actions.npy', best_actions)
+    # Indexed [player_sum - 1][dealer_card - 1][usable_ace], dealer ace as 1
+    rules = {"natural": env.natural, "sab": env.sab, "hit_soft_17": False}
+    save_policy('best_actions.npy', best_actions, BASIC_AXES, [1, 1, 0], rules, number=env.number,
+                source="mcts.MCTSAgent on BlackjackEnv deals (aces as 11); usable_ace 1 states are "
+                       "unreachable there and left as stand")
     print("Best Actions Array:")
     print(best_actions)
 
@@ -1,5 +1,9 @@
 import gym
-import numpy as np
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from policystore import open_policy
+from stateindex import encode
 
 class GameState:
     def __init__(self, observation, env, done=False, reward=0):
@@ -30,11 +34,8 @@ def play_game_with_policy(env, policy):
 
         player_sum, dealer_card, usable_ace = game_state
 
-        # Convert boolean usable_ace to integer for indexing
-        usable_ace = int(usable_ace)
-
-        # Get the action from the policy
-        action = policy[player_sum - 1][dealer_card - 1][usable_ace]
+        # Get the action from the policy (a basic strategy, the same at every temperature)
+        action = policy.flat()[encode(player_sum, dealer_card, usable_ace, 0)]
 
         # Step the environment
         observation, reward, terminated, truncated, _ = env.step(action)
@@ -66,7 +67,7 @@ def simulate_games(env, policy, num_games=1000):
     return results
 
 # Load the policy array
-best_actions = np.load('best_actions.npy')
+best_actions = open_policy('best_actions.npy')
 
 # Setup the environment
 env = gym.make('Blackjack-v1')
@@ -1,5 +1,11 @@
 import gym
-import numpy as np
+import os
+import sys
+from functools import partial
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from parallelsim import simulate_games_parallel
+from policystore import open_policy
+from stateindex import encode
 
 class GameState:
     def __init__(self, observation, env, done=False, reward=0):
@@ -30,11 +36,8 @@ def play_game_with_policy(env, policy):
 
         player_sum, dealer_card, usable_ace = game_state
 
-        # Convert boolean usable_ace to integer for indexing
-        usable_ace = int(usable_ace)
-
-        # Get the action from the policy
-        action = policy[player_sum - 1][dealer_card - 1][usable_ace]
+        # Get the action from the policy (a basic strategy, the same at every temperature)
+        action = policy.flat()[encode(player_sum, dealer_card, usable_ace, 0)]
 
         # Step the environment
         observation, reward, terminated, truncated, _ = env.step(action)
@@ -65,12 +68,11 @@ def simulate_games(env, policy, num_games=1000):
 
     return results
 
-# Load the policy array
-best_actions = np.load('learnedpolicy.npy')
-
-# Setup the environment
-env = gym.make('Blackjack-v1')
+if __name__ == "__main__":
+    # Load the policy array
+    best_actions = open_policy('learnedpolicy.npy')
 
-# Simulate the games
-results = simulate_games(env, best_actions, 1000)
-print(f"Simulation results: {results}")
+    # Simulate the games, split across one worker process per core
+    env_fn = partial(gym.make, 'Blackjack-v1')
+    results = simulate_games_parallel(env_fn, play_game_with_policy, best_actions, 1000, seed=0)
+    print(f"Simulation results: {results}")
@@ -0,0 +1,255 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Agent"))
+
+from blackjack import BlackjackEnv
+from cardcounter import ValueIterationAgent
+from cardcountersim import simulate_games
+from irl_blackjack import DeckTracker
+from mcts import MCTSAgent
+from policystore import open_policy
+import temperature
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(ROOT, "benchmarks.json")
+
+
+# Each benchmark runs one seeded workload and returns (value, unit, higher_is_better)
+
+
+def fastest(chunk, num_chunks=50):
+    # Time chunk() num_chunks times and return the fastest, in seconds. Every
+    # chunk replays the same seeded work, and short chunks mostly fall between
+    # the machine's slow spells, so the fastest one is a much steadier figure
+    # than the time of the whole workload.
+    best = float("inf")
+    for _ in range(num_chunks):
+        start = time.perf_counter()
+        chunk()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_env_step(chunk_steps=2000):
+    env = BlackjackEnv()
+    actions = np.random.RandomState(0).randint(2, size=chunk_steps).tolist()
+
+    def chunk():
+        env.reset(seed=0)
+        for action in actions:
+            _, _, terminated, truncated, _ = env.step(action)
+            if terminated or truncated:
+                env.reset()
+
+    return chunk_steps / fastest(chunk), "steps/s", True
+
+
+def bench_env_reset(chunk_resets=1000):
+    env = BlackjackEnv()
+
+    def chunk():
+        env.reset(seed=0)
+        for _ in range(chunk_resets):
+            env.reset()
+
+    return chunk_resets / fastest(chunk), "resets/s", True
+
+
+def bench_calc_temperature(chunk_calls=5000):
+    env = BlackjackEnv()
+    env.reset(seed=0)
+    deck = env.deck
+
+    def chunk():
+        for _ in range(chunk_calls):
+            deck.calc_temperature()
+
+    return fastest(chunk) / chunk_calls * 1e6, "us/call", False
+
+
+def bench_value_iteration():
+    # The tensor solver cardcounter.py runs, from zero values to convergence
+    probabilities = np.load(os.path.join(ROOT, "probabilities.npy"))
+    env = BlackjackEnv()
+
+    def chunk():
+        with contextlib.redirect_stdout(io.StringIO()):
+            ValueIterationAgent(probabilities).value_iteration(env, mode="tensor")
+
+    return fastest(chunk) * 1000, "ms", False
+
+
+def bench_simulate_games(chunk_games=500):
+    env = BlackjackEnv()
+    policy = open_policy(os.path.join(ROOT, "learnedpolicy3.npy"))
+
+    def chunk():
+        env.reset(seed=0)
+        simulate_games(env, policy, chunk_games)
+
+    return chunk_games / fastest(chunk), "hands/s", True
+
+
+def bench_find_probabilities(chunk_draws=100000):
+    # findProbabilities writes probabilities.npy to the working directory
+    def chunk():
+        with contextlib.redirect_stdout(io.StringIO()):
+            temperature.findProbabilities(
+                chunk_draws, int(52 * 6 * 0.7), np_random=np.random.RandomState(0)
+            )
+
+    with tempfile.TemporaryDirectory() as directory:
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            elapsed = fastest(chunk, 30)
+        finally:
+            os.chdir(cwd)
+    return chunk_draws / elapsed, "draws/s", True
+
+
+def bench_mcts(chunk_iterations=500):
+    env = BlackjackEnv()
+    agent = MCTSAgent(chunk_iterations)
+
+    def chunk():
+        random.seed(0)
+        env.reset(seed=0, options={"player": [10, 6], "dealer": [9]})
+        agent.select_action(env)
+
+    return chunk_iterations / fastest(chunk), "iterations/s", True
+
+
+def bench_this_card_dealt(chunk_shoes=10):
+    tracker = DeckTracker(6)
+    cards = tracker.cards
+    random.Random(0).shuffle(cards)
+    cards = cards[:-1]
+
+    def chunk():
+        for _ in range(chunk_shoes):
+            tracker.reset()
+            for card in cards:
+                tracker.this_card_dealt(card)
+
+    return fastest(chunk) / (chunk_shoes * len(cards)) * 1e6, "us/card", False
+
+
+BENCHMARKS = {
+    "env_step": bench_env_step,
+    "env_reset": bench_env_reset,
+    "calc_temperature": bench_calc_temperature,
+    "value_iteration": bench_value_iteration,
+    "simulate_games": bench_simulate_games,
+    "find_probabilities": bench_find_probabilities,
+    "mcts_select_action": bench_mcts,
+    "this_card_dealt": bench_this_card_dealt,
+}
+
+
+def run(names=None, repeats=5):
+    """Run the benchmarks; each result is the best of repeats runs after a warm-up run.
+
+    Every workload is seeded, so runs differ only in timing noise, which only
+    ever slows a run down: the best run is the most repeatable figure. spread
+    is how far the median run fell behind the best one, as a fraction; it is
+    reported for information and compare does not use it.
+    """
+    benchmarks = {name: BENCHMARKS[name] for name in names or BENCHMARKS}
+    kinds = {}
+    for name, benchmark in benchmarks.items():
+        _, unit, higher_is_better = benchmark()
+        kinds[name] = unit, higher_is_better
+    # Round robin, so a slow spell on the machine hits every benchmark alike
+    # rather than all the repeats of one
+    values = {name: [] for name in benchmarks}
+    for _ in range(repeats):
+        for name, benchmark in benchmarks.items():
+            values[name].append(benchmark()[0])
+    results = {}
+    for name in benchmarks:
+        unit, higher_is_better = kinds[name]
+        best = max(values[name]) if higher_is_better else min(values[name])
+        results[name] = {
+            "value": float(best),
+            "unit": unit,
+            "higher_is_better": higher_is_better,
+            "spread": float(abs(np.median(values[name]) - best) / best),
+        }
+        print(f"{name}: {results[name]['value']:.4g} {unit}")
+    return {
+        "machine": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "repeats": repeats,
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold=0.25):
+    # Benchmarks at least threshold (as a fraction) worse than the baseline
+    regressions = []
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            print(f"{name}: {result['value']:.4g} {result['unit']} (no baseline)")
+            continue
+        base = baseline["results"][name]["value"]
+        change = result["value"] / base - 1
+        worse = -change if result["higher_is_better"] else change
+        flag = "REGRESSION" if worse > threshold else ""
+        print(
+            f"{name}: {base:.4g} -> {result['value']:.4g} {result['unit']} "
+            f"({change:+.1%}; spread {result['spread']:.0%}) {flag}"
+        )
+        if worse > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the env, solvers, simulators and tracker.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and save the results")
+    run_parser.add_argument("output", nargs="?", default=BASELINE)
+    run_parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS))
+    run_parser.add_argument("--repeats", type=int, default=5)
+    compare_parser = subparsers.add_parser("compare", help="run or load results and compare with a baseline")
+    compare_parser.add_argument("baseline", nargs="?", default=BASELINE)
+    compare_parser.add_argument("current", nargs="?", help="saved results (runs the benchmarks if omitted)")
+    compare_parser.add_argument("--threshold", type=float, default=0.25)
+    compare_parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        save(run(args.only, args.repeats), args.output)
+    else:
+        baseline = load(args.baseline)
+        current = load(args.current) if args.current else run(list(baseline["results"]), args.repeats)
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print(f"Regressions beyond {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
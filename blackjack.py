@@ -6,66 +6,182 @@ from gym import spaces
 from gym.error import DependencyNotInstalled
 import random
 import math
+from bisect import bisect_right
+from collections import namedtuple
+
+from stateindex import NUM_STATES, encode
+
+
+# One "deck" as dealt by Deck: one card of each rank, aces counted as 11
+CARDS = [11, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10]
+
+# Define the breakpoints for the categories (calculated as deciles of distribution)
+# This approach ensures approximately equal distribution in states across categories
+# and thus should theoretically maximize the utility of the heuristic.
+DECILES = [
+    7.14893617,
+    7.22043011,
+    7.26219512,
+    7.28911565,
+    7.30964467,
+    7.33218467,
+    7.36220472,
+    7.40425532,
+    7.47742178,
+    8.242105263157894,
+]
+
+
+def categorize(value):
+    # Find the category for the given value by binary search over the breakpoints
+    # Return the last category if value is not less than any breakpoint
+    return min(bisect_right(DECILES, value), 9)
+
+
+def categorize_array(values):
+    # Vectorized categorize over an array of shoe averages
+    return np.minimum(np.searchsorted(DECILES, values, side="right"), 9)
+
+
+# Everything needed to put a BlackjackEnv back into an exact mid-hand state
+EnvSnapshot = namedtuple(
+    "EnvSnapshot",
+    [
+        "player",
+        "dealer",
+        "cards",
+        "total",
+        "counts",
+        "rng_state",
+        "dealer_top_card_suit",
+        "dealer_top_card_value_str",
+    ],
+)
 
 
 def cmp(a, b):
     return float(a > b) - float(a < b)
 
 
+class ShoePool:
+    """Pre-shuffled copies of a shoe, shuffled in bulk and handed out one at a time.
+
+    Buffers are reused once the pool is exhausted, so a shoe returned by next()
+    is only valid until the pool is refilled.
+    """
+
+    def __init__(self, np_random, cards, size=1):
+        self.np_random = np_random
+        self.cards = np.asarray(cards, dtype=np.int8)
+        self.size = size
+        self.buffers = np.empty((size, len(self.cards)), dtype=np.int8)
+        self.index = size
+        self.total = int(self.cards.sum())
+        self.counts = np.bincount(self.cards, minlength=12).tolist()
+
+    def refill(self):
+        if self.size == 1:
+            self.buffers[0] = self.cards
+            self.np_random.shuffle(self.buffers[0])
+        else:
+            # One random key per card; sorting the keys shuffles every buffer at once
+            order = np.argsort(
+                self.np_random.random_sample(self.buffers.shape), axis=1
+            )
+            np.take(self.cards, order, out=self.buffers)
+        self.index = 0
+
+    def clear(self):
+        # Drop the remaining pre-shuffled shoes so the next one triggers a refill
+        self.index = self.size
+
+    def next(self):
+        if self.index == self.size:
+            self.refill()
+        shoe = self.buffers[self.index]
+        self.index += 1
+        return shoe
+
+
 class Deck:
-    def __init__(self, np_random, number):
+    def __init__(self, np_random, number, pool_size=1):
         self.np_random = np_random
         self.number = number
+        self.pool = ShoePool(np_random, CARDS * number, pool_size)
+        self.shuffles = 0
         self.reset()
 
     def reset(self):
-        self.cards = [11, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10] * self.number
-        self.np_random.shuffle(self.cards)
+        self.shuffles += 1
+        self.cards = self.pool.next()
+        self.cursor = 0
+        # Running shoe statistics, kept up to date as cards are drawn
+        self.total = self.pool.total
+        self.counts = list(self.pool.counts)
 
     def draw_card(self):
-        if not self.cards:
+        if self.cursor == len(self.cards):
             self.reset()
-        return self.cards.pop()
+        card = int(self.cards[self.cursor])
+        self.cursor += 1
+        self.total -= card
+        self.counts[card] -= 1
+        return card
+
+    def penetration(self):
+        # Fraction of a full shoe that has been dealt
+        return 1.0 - len(self) / (len(CARDS) * self.number)
 
     def draw_hand(self):
         return [self.draw_card(), self.draw_card()]
 
+    def load(self, cards):
+        # Deal from the given undealt cards (e.g. a live tracker's shoe), shuffled
+        self.cards = np.array([11 if card == 1 else card for card in cards], dtype=np.int8)
+        self.cursor = 0
+        self.np_random.shuffle(self.cards)
+        self.total = int(self.cards.sum())
+        self.counts = np.bincount(self.cards, minlength=12).tolist()
+
+    def remove_card(self, card):
+        # Take a specific card out of the undealt cards (aces may be given as 1)
+        value = 11 if card == 1 else card
+        positions = np.flatnonzero(self.cards[self.cursor :] == value)
+        if not len(positions):
+            raise ValueError(f"card {card} is not in the shoe")
+        position = self.cursor + positions[0]
+        self.cards[position] = self.cards[self.cursor]
+        self.cards[self.cursor] = value
+        self.draw_card()
+
+    def return_card(self, card):
+        # Put a dealt card back among the undealt cards
+        value = 11 if card == 1 else card
+        self.cards = np.append(self.cards[self.cursor :], np.int8(value))
+        self.cursor = 0
+        self.total += value
+        self.counts[value] += 1
+
+    def shuffle_remaining(self):
+        self.cards = self.cards[self.cursor :].copy()
+        self.cursor = 0
+        self.np_random.shuffle(self.cards)
+
     def scale_value(self, value):
         scaled_value = ((value - 6.0) / (7.8 - 6.0)) * 9
         return scaled_value
 
     def __str__(self):
         result = ""
-        for card in self.cards:
+        for card in self.cards[self.cursor :]:
             result += str(card) + "\n"
         return result
 
     def __len__(self):
-        return len(self.cards)
+        return len(self.cards) - self.cursor
 
     def categorize(self, value):
-        # Define the breakpoints for the categories (calculated as deciles of distribution)
-        # This approach ensures approximately equal distribution in states across categories
-        # and thus should theoretically maximize the utility of the heuristic.
-        deciles = [
-            7.14893617,
-            7.22043011,
-            7.26219512,
-            7.28911565,
-            7.30964467,
-            7.33218467,
-            7.36220472,
-            7.40425532,
-            7.47742178,
-            8.242105263157894,
-        ]
-
-        # Find the category for the given value
-        for i, breakpoint in enumerate(deciles):
-            if value < breakpoint:
-                return i
-
-        return 9  # Return the last category if value is not less than any breakpoint
+        return categorize(value)
 
     def calc_temperature(self):
         avg_value = self.get_avg()
@@ -74,10 +190,7 @@ class Deck:
         return temperature
 
     def get_avg(self):
-        deck_value = 0
-        for card in self.cards:
-            deck_value += card
-        return float(deck_value) / len(self)
+        return float(self.total) / len(self)
 
 
 def usable_ace(hand):
@@ -102,30 +215,79 @@ def is_natural(hand):
     return sorted(hand) == [1, 10]
 
 
+SCREEN_WIDTH, SCREEN_HEIGHT = 600, 500
+
+# Rendering assets, loaded (and scaled or rendered) once per process
+_fonts = {}
+_card_images = {}
+_texts = {}
+
+
+def get_font(pygame, size):
+    if size not in _fonts:
+        path = os.path.join(os.path.dirname(__file__), "font", "Minecraft.ttf")
+        _fonts[size] = pygame.font.Font(path, size)
+    return _fonts[size]
+
+
+def get_card_image(pygame, name, size):
+    key = (name, size)
+    if key not in _card_images:
+        path = os.path.join(os.path.dirname(__file__), "img", name)
+        _card_images[key] = pygame.transform.scale(pygame.image.load(path), size)
+    return _card_images[key]
+
+
+def get_text(pygame, text, size):
+    key = (text, size)
+    if key not in _texts:
+        _texts[key] = get_font(pygame, size).render(text, True, (255, 255, 255))
+    return _texts[key]
+
+
 class BlackjackEnv(gym.Env):
     metadata = {"render_modes": ["human", "rgb_array"], "render_fps": 4}
 
     def __init__(
-        self, render_mode: Optional[str] = None, natural=False, sab=False, number=6
+        self,
+        render_mode: Optional[str] = None,
+        natural=False,
+        sab=False,
+        number=6,
+        pool_size=1,
+        state_index=False,
+        shuffle_at=None,
     ):
         self.action_space = spaces.Discrete(2)
-        self.observation_space = spaces.Tuple(
-            (
-                spaces.Discrete(32),
-                spaces.Discrete(11),
-                spaces.Discrete(2),
-                spaces.Discrete(10),
+        # With state_index, observations are the stateindex.encode integer
+        # instead of a (player_sum, dealer_card, usable_ace, temperature) tuple
+        self.state_index = state_index
+        if state_index:
+            self.observation_space = spaces.Discrete(NUM_STATES)
+        else:
+            self.observation_space = spaces.Tuple(
+                (
+                    spaces.Discrete(32),
+                    spaces.Discrete(11),
+                    spaces.Discrete(2),
+                    spaces.Discrete(10),
+                )
             )
-        )
         self.np_random = np.random.RandomState()
         self.number = number
-        self.deck = Deck(self.np_random, number)
+        self.pool_size = pool_size
+        self.deck = Deck(self.np_random, number, pool_size)
+        # None deals every hand from a freshly shuffled shoe; otherwise the shoe
+        # carries over between hands and is reshuffled once this fraction of it
+        # has been dealt (e.g. 0.7, as in temperature.main)
+        self.shuffle_at = shuffle_at
         self.natural = natural
         self.sab = sab
         self.render_mode = render_mode
 
     def step(self, action):
         assert self.action_space.contains(action)
+        shuffles = self.deck.shuffles
         if action:  # hit
             self.player.append(self.deck.draw_card())
             if is_bust(self.player):
@@ -136,8 +298,7 @@ class BlackjackEnv(gym.Env):
                 reward = 0.0
         else:  # stick
             terminated = True
-            while sum_hand(self.dealer) < 17:
-                self.dealer.append(self.deck.draw_card())
+            self._play_dealer()
             reward = cmp(score(self.player), score(self.dealer))
             if self.sab and is_natural(self.player) and not is_natural(self.dealer):
                 reward = 1.0
@@ -151,16 +312,93 @@ class BlackjackEnv(gym.Env):
         temperature = self.deck.calc_temperature()
         if self.render_mode == "human":
             self.render()
-        return (*self._get_obs(), temperature), reward, terminated, False, {}
+        # A shoe that runs out mid-hand is reshuffled by the deck
+        info = {"reshuffled": True} if self.deck.shuffles != shuffles else {}
+        return self._observation(temperature), reward, terminated, False, info
+
+    def _observation(self, temperature):
+        if self.state_index:
+            return encode(*self._get_obs(), temperature)
+        return (*self._get_obs(), temperature)
+
+    def _play_dealer(self):
+        while sum_hand(self.dealer) < 17:
+            self.dealer.append(self.deck.draw_card())
 
     def _get_obs(self):
         return (sum_hand(self.player), self.dealer[0], usable_ace(self.player))
 
+    def snapshot(self):
+        return EnvSnapshot(
+            list(self.player),
+            list(self.dealer),
+            self.deck.cards[self.deck.cursor :].copy(),
+            self.deck.total,
+            list(self.deck.counts),
+            self.np_random.get_state(),
+            self.dealer_top_card_suit,
+            self.dealer_top_card_value_str,
+        )
+
+    def restore(self, snapshot, rng=True):
+        # With rng=False the RandomState keeps its current stream, so repeated
+        # restores followed by draws sample different futures
+        self.player = list(snapshot.player)
+        self.dealer = list(snapshot.dealer)
+        self.deck.cards = snapshot.cards.copy()
+        self.deck.cursor = 0
+        self.deck.total = snapshot.total
+        self.deck.counts = list(snapshot.counts)
+        if rng:
+            self.np_random.set_state(snapshot.rng_state)
+        self.dealer_top_card_suit = snapshot.dealer_top_card_suit
+        self.dealer_top_card_value_str = snapshot.dealer_top_card_value_str
+
+    def clone(self):
+        env = BlackjackEnv(
+            None, self.natural, self.sab, self.number, self.pool_size, self.state_index, self.shuffle_at
+        )
+        env.restore(self.snapshot())
+        return env
+
+    def resample_hidden(self):
+        # Redeal what the player cannot see: the dealer's hole card and the order
+        # of the undealt cards. Searches use this to sample plausible futures.
+        self.deck.return_card(self.dealer[1])
+        self.deck.shuffle_remaining()
+        self.dealer[1] = self.deck.draw_card()
+
     def reset(self, seed: Optional[int] = None, options: Optional[dict] = None):
-        super().reset(seed=seed)
-        self.deck.reset()
-        self.dealer = self.deck.draw_hand()
-        self.player = self.deck.draw_hand()
+        super().reset()
+        if seed is not None:
+            # The deck shares this RandomState, so reseed it in place and
+            # discard shoes shuffled before seeding
+            self.np_random.seed(seed)
+            self.deck.pool.clear()
+        reshuffled = False
+        if options is not None and "cards" in options:
+            self.deck.load(options["cards"])
+        elif (
+            seed is not None
+            or self.shuffle_at is None
+            or self.deck.penetration() >= self.shuffle_at
+        ):
+            self.deck.reset()
+            reshuffled = True
+        if options is not None and "player" in options:
+            # Deal the given starting hands (the dealer's hole card is drawn if
+            # only the upcard is given) and take those cards out of the shoe,
+            # unless the undealt cards were given and already exclude them
+            self.dealer = list(options["dealer"])
+            self.player = list(options["player"])
+            if "cards" not in options:
+                for card in self.dealer + self.player:
+                    self.deck.remove_card(card)
+            if len(self.dealer) == 1:
+                self.dealer.append(self.deck.draw_card())
+        else:
+            self.dealer = self.deck.draw_hand()
+            self.player = self.deck.draw_hand()
         temperature = self.deck.calc_temperature()
         _, dealer_card_value, _ = self._get_obs()
         suits = ["C", "D", "H", "S"]
@@ -173,7 +411,7 @@ class BlackjackEnv(gym.Env):
             self.dealer_top_card_value_str = str(dealer_card_value)
         if self.render_mode == "human":
             self.render()
-        return (*self._get_obs(), temperature), {}
+        return self._observation(temperature), {"reshuffled": reshuffled}
 
     def render(self):
         if self.render_mode is None:
@@ -184,6 +422,44 @@ class BlackjackEnv(gym.Env):
             )
             return
 
+        pygame = self._init_screen()
+        self._draw(pygame, self.render_state(), self.screen)
+        if self.render_mode == "human":
+            pygame.event.pump()
+            pygame.display.update()
+            self.clock.tick(self.metadata["render_fps"])
+        else:
+            return np.transpose(
+                np.array(pygame.surfarray.pixels3d(self.screen)), axes=(1, 0, 2)
+            )
+
+    def render_state(self):
+        # What a frame shows; record one per step to render the episode later
+        player_sum, dealer_card_value, usable_ace = self._get_obs()
+        return (
+            player_sum,
+            dealer_card_value,
+            usable_ace,
+            self.dealer_top_card_suit,
+            self.dealer_top_card_value_str,
+        )
+
+    def render_frames(self, states):
+        """Render recorded render_state() tuples to an (n, height, width, 3) uint8 array.
+
+        Frames are drawn offscreen into one surface and copied straight into
+        the output array, whatever the env's render_mode.
+        """
+        pygame = self._init_screen(offscreen=True)
+        frames = np.empty((len(states), SCREEN_HEIGHT, SCREEN_WIDTH, 3), dtype=np.uint8)
+        for i, state in enumerate(states):
+            self._draw(pygame, state, self.frame_surface)
+            pixels = pygame.surfarray.pixels3d(self.frame_surface)
+            frames[i] = pixels.transpose(1, 0, 2)
+            del pixels  # unlock the surface before drawing the next frame
+        return frames
+
+    def _init_screen(self, offscreen=False):
         try:
             import pygame
         except ImportError:
@@ -191,59 +467,44 @@ class BlackjackEnv(gym.Env):
                 "pygame is not installed, run `pip install gym[toy_text]`"
             )
 
-        player_sum, dealer_card_value, usable_ace = self._get_obs()
-        screen_width, screen_height = 600, 500
-        card_img_height = screen_height // 3
-        card_img_width = int(card_img_height * 142 / 197)
-        spacing = screen_height // 20
-
-        bg_color = (7, 99, 36)
-        white = (255, 255, 255)
+        if offscreen:
+            if not hasattr(self, "frame_surface"):
+                pygame.font.init()
+                self.frame_surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+            return pygame
 
         if not hasattr(self, "screen"):
             pygame.init()
             if self.render_mode == "human":
                 pygame.display.init()
-                self.screen = pygame.display.set_mode((screen_width, screen_height))
+                self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
             else:
                 pygame.font.init()
-                self.screen = pygame.Surface((screen_width, screen_height))
+                self.screen = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
 
         if not hasattr(self, "clock"):
             self.clock = pygame.time.Clock()
+        return pygame
 
-        self.screen.fill(bg_color)
-
-        def get_image(path):
-            cwd = os.path.dirname(__file__)
-            image = pygame.image.load(os.path.join(cwd, path))
-            return image
+    def _draw(self, pygame, state, screen):
+        player_sum, dealer_card_value, usable_ace, suit, value_str = state
+        screen_width, screen_height = SCREEN_WIDTH, SCREEN_HEIGHT
+        card_img_height = screen_height // 3
+        card_img_width = int(card_img_height * 142 / 197)
+        spacing = screen_height // 20
 
-        def get_font(path, size):
-            cwd = os.path.dirname(__file__)
-            font = pygame.font.Font(os.path.join(cwd, path), size)
-            return font
+        bg_color = (7, 99, 36)
 
-        small_font = get_font(
-            os.path.join("font", "Minecraft.ttf"), screen_height // 15
-        )
-        dealer_text = small_font.render(
-            "Dealer: " + str(dealer_card_value), True, white
-        )
-        dealer_text_rect = self.screen.blit(dealer_text, (spacing, spacing))
+        screen.fill(bg_color)
 
-        def scale_card_img(card_img):
-            return pygame.transform.scale(card_img, (card_img_width, card_img_height))
+        small_size = screen_height // 15
+        dealer_text = get_text(pygame, "Dealer: " + str(dealer_card_value), small_size)
+        dealer_text_rect = screen.blit(dealer_text, (spacing, spacing))
 
-        dealer_card_img = scale_card_img(
-            get_image(
-                os.path.join(
-                    "img",
-                    f"{self.dealer_top_card_suit}{self.dealer_top_card_value_str}.png",
-                )
-            )
+        dealer_card_img = get_card_image(
+            pygame, f"{suit}{value_str}.png", (card_img_width, card_img_height)
         )
-        dealer_card_rect = self.screen.blit(
+        dealer_card_rect = screen.blit(
             dealer_card_img,
             (
                 screen_width // 2 - card_img_width - spacing // 2,
@@ -251,20 +512,19 @@ class BlackjackEnv(gym.Env):
             ),
         )
 
-        hidden_card_img = scale_card_img(get_image(os.path.join("img", "Card.png")))
-        self.screen.blit(
+        hidden_card_img = get_card_image(pygame, "Card.png", (card_img_width, card_img_height))
+        screen.blit(
             hidden_card_img,
             (screen_width // 2 + spacing // 2, dealer_text_rect.bottom + spacing),
         )
 
-        player_text = small_font.render("Player", True, white)
-        player_text_rect = self.screen.blit(
+        player_text = get_text(pygame, "Player", small_size)
+        player_text_rect = screen.blit(
             player_text, (spacing, dealer_card_rect.bottom + 1.5 * spacing)
         )
 
-        large_font = get_font(os.path.join("font", "Minecraft.ttf"), screen_height // 6)
-        player_sum_text = large_font.render(str(player_sum), True, white)
-        player_sum_text_rect = self.screen.blit(
+        player_sum_text = get_text(pygame, str(player_sum), screen_height // 6)
+        player_sum_text_rect = screen.blit(
             player_sum_text,
             (
                 screen_width // 2 - player_sum_text.get_width() // 2,
@@ -273,26 +533,22 @@ class BlackjackEnv(gym.Env):
         )
 
         if usable_ace:
-            usable_ace_text = small_font.render("usable ace", True, white)
-            self.screen.blit(
+            usable_ace_text = get_text(pygame, "usable ace", small_size)
+            screen.blit(
                 usable_ace_text,
                 (
                     screen_width // 2 - usable_ace_text.get_width() // 2,
                     player_sum_text_rect.bottom + spacing // 2,
                 ),
             )
-        if self.render_mode == "human":
-            pygame.event.pump()
-            pygame.display.update()
-            self.clock.tick(self.metadata["render_fps"])
-        else:
-            return np.transpose(
-                np.array(pygame.surfarray.pixels3d(self.screen)), axes=(1, 0, 2)
-            )
 
     def close(self):
-        if hasattr(self, "screen"):
+        if hasattr(self, "screen") or hasattr(self, "frame_surface"):
             import pygame
 
             pygame.display.quit()
             pygame.quit()
+            # Fonts and surfaces do not survive pygame.quit()
+            _fonts.clear()
+            _card_images.clear()
+            _texts.clear()
@@ -1,20 +1,30 @@
 import gym
 import numpy as np
 import sys
+import time
 sys.path.append('/Users/jamesrogers/.git/blackjack-agent')
 from blackjack import BlackjackEnv
+from dealer import rank_probabilities, stick_values
+from policystore import TEMPERATURE_AXES, calibration_hash, save_policy
 
 class ValueIterationAgent:
-    def __init__(self, temperature_values, gamma=1.0, theta=0.0001):
+    def __init__(self, temperature_values, gamma=1.0, theta=0.0001, hit_soft_17=False):
         self.temperature_values = temperature_values
+        self.card_probabilities = rank_probabilities(temperature_values)  # (temperature)(card value - 1), ace first
+        self.stick_values = stick_values(temperature_values, hit_soft_17)  # (Your Hand)(Dealer showing)(temperature)
         self.gamma = gamma
         self.theta = theta
         self.state_values = np.zeros((32, 11, 2, 10), dtype=float)  # States with temperature (Your Hand)(Dealer showing)(usable ace)(temperature)
         self.policy = np.zeros((32, 11, 2, 10), dtype=int)  # Policy with temperature
+        self.history = []  # (delta, seconds) for every sweep of the last value iteration run
 
-    def value_iteration(self, env):
+    def value_iteration(self, env, mode="loop"):
+        if mode == "tensor":
+            return self.value_iteration_tensor(env)
+        self.history = []
         count = 1
         while True:
+            start = time.perf_counter()
             delta = 0
             for player_sum in range(1, 32):
                 print("Player sum:" + str(player_sum))
@@ -25,6 +35,7 @@ class ValueIterationAgent:
                             v_new = self.evaluate_actions(env, player_sum, dealer_showing, usable_ace, temperature)
                             self.state_values[player_sum, dealer_showing, usable_ace, temperature] = v_new
                             delta = max(delta, abs(v_old - v_new))
+            self.history.append((delta, time.perf_counter() - start))
             if delta < self.theta:
                 break
             else:
@@ -32,56 +43,64 @@ class ValueIterationAgent:
                 count += 1
         self.extract_policy(env)
 
+    def _hit_transitions(self):
+        # Same transition as the hit branch of calculate_state_value, for every
+        # (Your Hand)(usable ace)(card value - 1) at once
+        player_sum = np.arange(32)[:, None, None]
+        usable_ace = np.arange(2)[None, :, None]
+        card_value = np.arange(1, 11)[None, None, :]
+        new_sum = player_sum + card_value + np.zeros_like(usable_ace)
+        new_sum = np.where(usable_ace & (new_sum + 10 <= 21), new_sum + 10, new_sum)
+        bust = new_sum > 21
+        return np.where(bust, 0, new_sum), bust
+
+    def _tensor_action_values(self, new_sum, bust):
+        # Q(stick) does not depend on the usable ace, Q(hit) is the expected value of the next state
+        stick = np.broadcast_to(self.stick_values[:, :, None, :], self.state_values.shape)
+        # next_values[p, a, c, d, t] is the value after drawing card c; every non-bust
+        # successor is looked up with usable ace 1, as in calculate_state_value
+        next_values = self.state_values[new_sum, :, 1, :]
+        next_values = np.where(bust[..., None, None], -1.0, next_values)
+        hit = np.einsum("pacdt,tc->pdat", next_values, self.card_probabilities)
+        return np.stack((stick, hit))
+
+    def value_iteration_tensor(self, env):
+        # Jacobi-style Bellman backups over the whole (32, 11, 2, 10) state array per sweep
+        assert env.action_space.n == 2
+        new_sum, bust = self._hit_transitions()
+        # Only player sums 1..31 and dealer cards 1..10 are states, as in the loop version
+        valid = np.zeros(self.state_values.shape, dtype=bool)
+        valid[1:, 1:] = True
+        self.history = []
+        count = 1
+        while True:
+            start = time.perf_counter()
+            v_new = self._tensor_action_values(new_sum, bust).max(axis=0)
+            v_new = np.where(valid, v_new, self.state_values)
+            delta = np.max(np.abs(v_new - self.state_values))
+            self.state_values = v_new
+            elapsed = time.perf_counter() - start
+            self.history.append((delta, elapsed))
+            print(f'{count}: {delta} ({elapsed * 1000:.2f} ms)')
+            if delta < self.theta:
+                break
+            count += 1
+        action_values = self._tensor_action_values(new_sum, bust)
+        self.policy = np.where(valid, np.argmax(action_values, axis=0), 0)
+
     def evaluate_actions(self, env, player_sum, dealer_showing, usable_ace, temperature):
         actions_values = np.zeros(env.action_space.n)
         for action in range(env.action_space.n):
             actions_values[action] = self.calculate_state_value(player_sum, dealer_showing, usable_ace, action, temperature)
         return np.max(actions_values)
     
-    def _calculate_dealer_odds(self, dealer_showing, temperature, dealer_odds, weight = 1.0):
-        for card_value, prob in enumerate(self.temperature_values[temperature]):
-                dealer_sum = dealer_showing + card_value + 1
-                if dealer_sum in dealer_odds:
-                    dealer_odds[dealer_sum] += weight * prob
-                else:
-                    if dealer_sum < 21:
-                        ## BUGFIX ## was missing prob * weight
-                        self._calculate_dealer_odds(dealer_sum, temperature, dealer_odds, weight = prob * weight)
-
     def calculate_state_value(self, player_sum, dealer_showing, usable_ace, action, temperature):
         if action == 0:  # stick
-
-            # The expected_reward will be accumulated
-            expected_reward = 0
-
-            # Dictionary, will contain the dealer's odds of achieving these hands (sticking on a soft 17)
-            # Could be memoized
-            dealer_odds = {17: 0.0, 18: 0.0, 19: 0.0, 20: 0.0, 21: 0.0}
-
-            # Busting will be the probability of none of the above
-            bust = 1.0
-
-            # Should calculate the odds of the dealer achieving each of the above hands
-            self._calculate_dealer_odds(dealer_showing, temperature, dealer_odds)
-            for dealer_hand_value in dealer_odds:
-                bust -= dealer_odds[dealer_hand_value]
-            
-            expected_reward = 0.0
-            
-            for dealer_hand_value in dealer_odds:
-                if dealer_hand_value > player_sum:
-                    expected_reward -= 1 * dealer_odds[dealer_hand_value]
-                elif dealer_hand_value == player_sum:
-                    expected_reward += 0
-                elif dealer_hand_value < player_sum:
-                    expected_reward += 1 * dealer_odds[dealer_hand_value]
-            
-            expected_reward += 1 * bust
-            
-            return expected_reward
+            # Dealer outcome odds are precomputed once per temperature (see dealer.py)
+            return self.stick_values[player_sum, dealer_showing, temperature]
         else:  # hit
             expected_reward = 0
-            for card_value, prob in enumerate(self.temperature_values[temperature]):
+            for card_value, prob in enumerate(self.card_probabilities[temperature]):
                 new_sum = player_sum + card_value + 1  # card_value is 0-indexed, card values start from 1
                 if usable_ace and new_sum + 10 <= 21:  # Check for usable ace
                     new_sum += 10
@@ -108,22 +127,27 @@ class ValueIterationAgent:
 def cmp(a, b):
     return float(a > b) - float(a < b)
 
-# Initialize your custom environment
-env = BlackjackEnv()
-
-# Create an array of temperature values based on your deck temperatures
-# Replace the following line with your actual temperature values
-temperature_values = np.load('probabilities.npy')
-
-# Initialize the agent and perform value iteration
-agent = ValueIterationAgent(temperature_values)
-print("Agent successfully initialized...")
-print("Value iteration beginning...")
-agent.value_iteration(env)
-
-# Display the learned policy
-print("Learned Policy:")
-print(agent.policy)
-
-# Save the learned policy as 'learnedpolicy.npy'
-np.save('learnedpolicy3.npy', agent.policy)
+if __name__ == "__main__":
+    # Initialize your custom environment
+    env = BlackjackEnv()
+
+    # Create an array of temperature values based on your deck temperatures
+    # Replace the following line with your actual temperature values
+    temperature_values = np.load('probabilities.npy')
+
+    # Initialize the agent and perform value iteration
+    agent = ValueIterationAgent(temperature_values)
+    print("Agent successfully initialized...")
+    print("Value iteration beginning...")
+    agent.value_iteration(env, mode="tensor")
+
+    # Display the learned policy
+    print("Learned Policy:")
+    print(agent.policy)
+
+    # Save the learned policy as 'learnedpolicy3.npy', indexed by the raw state values
+    rules = {"natural": env.natural, "sab": env.sab, "hit_soft_17": False}
+    save_policy('learnedpolicy3.npy', agent.policy, TEMPERATURE_AXES, [0, 0, 0, 0], rules,
+                number=env.number, calibration=calibration_hash(temperature_values),
+                source="cardcounter.ValueIterationAgent (tensor); probabilities.npy columns read as "
+                       "card values 2..11, ace last, via dealer.rank_probabilities")
@@ -1,6 +1,11 @@
+import math
+import time
+from statistics import NormalDist
 import gym
-import numpy as np
 from blackjack import BlackjackEnv
+from parallelsim import simulate_games_parallel
+from policystore import open_policy
+from stateindex import encode
 
 class GameState:
     def __init__(self, observation, env, done=False, reward=0):
@@ -30,8 +35,7 @@ def play_game_with_policy(env, policy):
             game_state = observation
 
         player_sum, dealer_card, usable_ace, temperature = game_state  # Unpack including temperature
-        usable_ace = int(usable_ace)  # Convert boolean usable_ace to integer for indexing
-        action = policy[player_sum - 1][dealer_card - 1][usable_ace][temperature]
+        action = policy.flat()[encode(player_sum, dealer_card, usable_ace, temperature)]
         observation, reward, terminated, truncated, _ = env.step(action)
         total_reward += reward
         done = terminated or truncated
@@ -53,14 +57,69 @@ def simulate_games(env, policy, num_games=1000):
 
     return results
 
-# Load the policy array
-best_actions = np.load('learnedpolicy3.npy')
+class RunningStats:
+    # Welford's online mean and variance
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
 
-# Setup the environment
-env = BlackjackEnv()
+    def update(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
 
-# Simulate the games
-num_games = 10000  # Number of games you want to simulate
-results = simulate_games(env, best_actions, num_games)
-print(f"Simulation results: {results}")
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else float('inf')
 
+    def stderr(self):
+        return math.sqrt(self.variance / self.count) if self.count > 1 else float('inf')
+
+
+def simulate_until(env, policy, half_width=0.01, confidence=0.95, max_games=None,
+                   max_seconds=None, chunk_size=1000, min_games=10000):
+    """Play games in chunks until the EV confidence interval is narrow enough.
+
+    Yields an interim estimate after every chunk of chunk_size games. Play
+    stops once the interval's half-width is at most half_width (after at least
+    min_games), or when max_games or max_seconds runs out; the last estimate
+    yielded says which with "stopped".
+    """
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    stats = RunningStats()
+    results = {'wins': 0, 'losses': 0, 'draws': 0}
+    start = time.perf_counter()
+    while True:
+        for _ in range(chunk_size if max_games is None else min(chunk_size, max_games - stats.count)):
+            reward = play_game_with_policy(env, policy)
+            stats.update(reward)
+            if reward > 0:
+                results['wins'] += 1
+            elif reward < 0:
+                results['losses'] += 1
+            else:
+                results['draws'] += 1
+
+        elapsed = time.perf_counter() - start
+        estimate = dict(results, games=stats.count, ev=stats.mean, half_width=z * stats.stderr(),
+                        seconds=elapsed, stopped=None)
+        if stats.count >= min_games and estimate['half_width'] <= half_width:
+            estimate['stopped'] = 'half_width'
+        elif max_games is not None and stats.count >= max_games:
+            estimate['stopped'] = 'max_games'
+        elif max_seconds is not None and elapsed >= max_seconds:
+            estimate['stopped'] = 'max_seconds'
+        yield estimate
+        if estimate['stopped']:
+            return
+
+if __name__ == "__main__":
+    # Load the policy array
+    best_actions = open_policy('learnedpolicy3.npy')
+
+    # Simulate the games, split across one worker process per core
+    num_games = 10000  # Number of games you want to simulate
+    results = simulate_games_parallel(BlackjackEnv, play_game_with_policy, best_actions, num_games, seed=0)
+    print(f"Simulation results: {results}")
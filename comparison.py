@@ -0,0 +1,103 @@
+import math
+from statistics import NormalDist
+import numpy as np
+
+from blackjack import BlackjackEnv
+from parallelsim import map_chunks, split_work
+from policystore import open_policy
+from stateindex import encode
+
+
+def _play(env, flat_policy):
+    # Play the hand the env was reset or restored to; observations are state indices
+    observation = encode(*env._get_obs(), env.deck.calc_temperature())
+    while True:
+        observation, reward, terminated, truncated, _ = env.step(int(flat_policy[observation]))
+        if terminated or truncated:
+            return reward
+
+
+def _compare_chunk(args):
+    policies, num_hands, seed, env_kwargs = args
+    env = BlackjackEnv(state_index=True, **env_kwargs)
+    env.reset(seed=seed)
+    flat_policies = [policy.flat() for policy in policies]
+    rewards = np.empty((num_hands, len(policies)))
+    for hand in range(num_hands):
+        # Deal one hand, then let every policy play it from the same shoe
+        env.reset()
+        start = env.snapshot()
+        for k, flat_policy in enumerate(flat_policies):
+            env.restore(start)
+            rewards[hand, k] = _play(env, flat_policy)
+    return rewards
+
+
+def compare_policies(
+    policies, num_hands=100000, num_workers=None, seed=0, confidence=0.95, env_kwargs=None
+):
+    """Play several policies on the same hands and compare them in pairs.
+
+    Every hand is dealt once and each policy plays it from that exact shoe
+    (common random numbers), so differences between policies are not drowned
+    out by differences between the cards they were dealt. policies are
+    PolicyTables or paths to them. Returns the per-policy EVs and, for every
+    pair (a, b), the EV difference b - a with its standard error and
+    confidence interval, next to the standard error two independent runs of
+    the same size would have had.
+    """
+    policies = [open_policy(policy) if isinstance(policy, str) else policy for policy in policies]
+    chunks = [
+        (policies, chunk_hands, chunk_seed, env_kwargs or {})
+        for chunk_hands, chunk_seed in split_work(num_hands, num_workers, seed)
+    ]
+    rewards = np.concatenate(map_chunks(_compare_chunk, chunks))
+    return summarize(rewards, [policy.path for policy in policies], confidence)
+
+
+def summarize(rewards, names, confidence=0.95):
+    # rewards[hand, k] is what policy k won on each shared hand
+    n = len(rewards)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    means = rewards.mean(axis=0)
+    stderrs = rewards.std(axis=0, ddof=1) / math.sqrt(n)
+    summary = {
+        "hands": n,
+        "confidence": confidence,
+        "policies": {
+            name: {"ev": float(mean), "stderr": float(stderr)}
+            for name, mean, stderr in zip(names, means, stderrs)
+        },
+        "differences": [],
+    }
+    for a in range(len(names)):
+        for b in range(a + 1, len(names)):
+            difference = rewards[:, b] - rewards[:, a]
+            mean = float(difference.mean())
+            stderr = float(difference.std(ddof=1) / math.sqrt(n))
+            summary["differences"].append(
+                {
+                    "a": names[a],
+                    "b": names[b],
+                    "difference": mean,
+                    "stderr": stderr,
+                    "ci": (mean - z * stderr, mean + z * stderr),
+                    "independent_stderr": float(math.hypot(stderrs[a], stderrs[b])),
+                }
+            )
+    return summary
+
+
+if __name__ == "__main__":
+    summary = compare_policies(
+        ["best_actions.npy", "learnedpolicy.npy", "learnedpolicy3.npy"], num_hands=100000
+    )
+    for name, result in summary["policies"].items():
+        print(f"{name}: EV {result['ev']:+.4f} +/- {result['stderr']:.4f}")
+    for result in summary["differences"]:
+        low, high = result["ci"]
+        print(
+            f"{result['b']} - {result['a']}: {result['difference']:+.4f} "
+            f"({summary['confidence']:.0%} CI {low:+.4f} to {high:+.4f}; "
+            f"stderr {result['stderr']:.4f} paired vs {result['independent_stderr']:.4f} independent)"
+        )
@@ -0,0 +1,202 @@
+import sys
+from collections import OrderedDict
+import numpy as np
+
+from dealer import BUST, DEALER_TOTALS, dealer_outcome
+
+# Memo entry kinds, stored as the last byte of each cache key
+_DEALER = 0
+_PLAYER = 1
+
+
+def dealer_paths(upcard, hit_soft_17=False):
+    """Every way the dealer can finish from an upcard, grouped by the cards drawn.
+
+    Returns (drawn, ways, outcome): drawn[g] counts the cards of each rank the
+    dealer draws (ace first), ways[g] the number of orders in which they can
+    be drawn and outcome[g] the dealer outcome they lead to. The set of paths
+    does not depend on the shoe, so it is computed once per upcard.
+    """
+    frontier = {(0,) * 10: 1}
+    finished = {}
+    while frontier:
+        drawn_next = {}
+        for drawn, ways in frontier.items():
+            for rank in range(1, 11):
+                after = list(drawn)
+                after[rank - 1] += 1
+                after = tuple(after)
+                hard_total = upcard + sum(r * k for r, k in enumerate(after, start=1))
+                outcome = dealer_outcome(hard_total, upcard == 1 or after[0] > 0, hit_soft_17)
+                if outcome is None:
+                    drawn_next[after] = drawn_next.get(after, 0) + ways
+                else:
+                    finished[after, outcome] = finished.get((after, outcome), 0) + ways
+        frontier = drawn_next
+    keys = list(finished)
+    drawn = np.array([after for after, _ in keys], dtype=np.intp)
+    ways = np.array([finished[key] for key in keys], dtype=float)
+    outcome = np.array([outcome for _, outcome in keys], dtype=np.intp)
+    return drawn, ways, outcome
+
+
+def rank_counts(cards):
+    # Remaining cards (e.g. DeckTracker.cards, aces as 11 or 1) as counts of ranks 1..10, ace first
+    counts = [0] * 10
+    for card in cards:
+        counts[0 if card in (1, 11) else card - 1] += 1
+    return counts
+
+
+class LRUCache:
+    """Least-recently-used memo bounded by an estimate of the memory it holds."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        # Key and value objects plus roughly 100 bytes of dict slot and link overhead
+        self.nbytes += sys.getsizeof(key) + sys.getsizeof(value) + 100
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            old_key, old_value = self.entries.popitem(last=False)
+            self.nbytes -= sys.getsizeof(old_key) + sys.getsizeof(old_value) + 100
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class CompositionSolver:
+    """Exact hit/stick decisions for the precise remaining shoe.
+
+    Instead of the 10-bucket temperature, the solver takes the count of each
+    rank left in the shoe and computes expected values by recursion over every
+    player draw. The dealer (who stands on 17, or hits soft 17 with
+    hit_soft_17) is evaluated over all of its drawing paths at once.
+    Subproblems are memoised by their count vector, so results are shared
+    between decisions as the shoe depletes; the memo is bounded to roughly
+    max_bytes.
+    """
+
+    def __init__(self, max_bytes=256 * 2**20, hit_soft_17=False):
+        self.cache = LRUCache(max_bytes)
+        self.hit_soft_17 = hit_soft_17
+        self.paths = {}
+
+    def _key(self, counts, hard_total, has_ace, upcard, kind):
+        return counts + bytes((hard_total, has_ace, upcard, kind))
+
+    def _draws(self, counts):
+        # (rank, probability, counts after the draw) for every rank left in the shoe
+        total = sum(counts)
+        for index, count in enumerate(counts):
+            if count:
+                remaining = bytearray(counts)
+                remaining[index] -= 1
+                yield index + 1, count / total, bytes(remaining)
+
+    def _paths(self, upcard):
+        if upcard not in self.paths:
+            self.paths[upcard] = dealer_paths(upcard, self.hit_soft_17)
+        return self.paths[upcard]
+
+    def dealer_outcomes(self, counts, upcard):
+        """Probability of the dealer finishing on 17..21 or busting from this shoe."""
+        key = self._key(counts, upcard, upcard == 1, 0, _DEALER)
+        outcome = self.cache.get(key)
+        if outcome is not None:
+            return outcome
+
+        drawn, ways, outcomes = self._paths(upcard)
+        counts = np.frombuffer(counts, dtype=np.uint8).astype(float)
+        depth = drawn.max() + 1
+        # falling[r, k] = c_r (c_r - 1) ... (c_r - k + 1): ways to draw k cards of rank r in order
+        falling = np.cumprod(
+            np.maximum(counts[:, None] - np.arange(depth - 1)[None, :], 0), axis=1
+        )
+        falling = np.hstack((np.ones((10, 1)), falling))
+        total = counts.sum()
+        length = drawn.sum(axis=1)
+        shoe = np.cumprod(np.maximum(total - np.arange(length.max()), 0))
+        shoe = np.concatenate(([1.0], shoe))
+        numerator = np.prod(falling[np.arange(10), drawn], axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            probability = np.where(shoe[length] > 0, ways * numerator / shoe[length], 0.0)
+        outcome = np.bincount(outcomes, weights=probability, minlength=BUST + 1)
+        outcome = tuple(outcome.tolist())
+        self.cache.put(key, outcome)
+        return outcome
+
+    def _stick_value(self, counts, total, upcard):
+        outcome = self.dealer_outcomes(counts, upcard)
+        value = outcome[BUST]
+        for i, dealer_total in enumerate(DEALER_TOTALS):
+            if total > dealer_total:
+                value += outcome[i]
+            elif total < dealer_total:
+                value -= outcome[i]
+        return value
+
+    def _hit_value(self, counts, hard_total, has_ace, upcard):
+        value = 0.0
+        for rank, prob, remaining in self._draws(counts):
+            new_hard = hard_total + rank
+            if new_hard > 21:
+                value -= prob  # bust
+            else:
+                value += prob * self._best_value(
+                    remaining, new_hard, has_ace or rank == 1, upcard
+                )
+        return value
+
+    def _best_value(self, counts, hard_total, has_ace, upcard):
+        key = self._key(counts, hard_total, has_ace, upcard, _PLAYER)
+        value = self.cache.get(key)
+        if value is not None:
+            return value
+
+        total = hard_total + 10 if has_ace and hard_total + 10 <= 21 else hard_total
+        value = self._stick_value(counts, total, upcard)
+        if total < 21:
+            value = max(value, self._hit_value(counts, hard_total, has_ace, upcard))
+        self.cache.put(key, value)
+        return value
+
+    def _state(self, counts, player_sum, dealer_card, usable_ace):
+        counts = list(counts)
+        if len(counts) != 10 or max(counts) > 255 or min(counts) < 0:
+            raise ValueError("counts must hold 10 rank counts between 0 and 255")
+        upcard = 1 if dealer_card == 11 else dealer_card
+        # A hand without a usable ace can never make one usable again, so only
+        # the usable ace needs to be tracked
+        hard_total = player_sum - 10 if usable_ace else player_sum
+        return bytes(counts), hard_total, bool(usable_ace), upcard
+
+    def action_values(self, counts, player_sum, dealer_card, usable_ace=False):
+        """Expected reward of (stick, hit) given the remaining rank counts, ace first."""
+        counts, hard_total, has_ace, upcard = self._state(
+            counts, player_sum, dealer_card, usable_ace
+        )
+        stick = self._stick_value(counts, player_sum, upcard)
+        hit = self._hit_value(counts, hard_total, has_ace, upcard)
+        return stick, hit
+
+    def decide(self, counts, player_sum, dealer_card, usable_ace=False):
+        # Returns (action, expected reward); actions are 0 = stick, 1 = hit as in BlackjackEnv
+        stick, hit = self.action_values(counts, player_sum, dealer_card, usable_ace)
+        if hit > stick:
+            return 1, hit
+        return 0, stick
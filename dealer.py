@@ -0,0 +1,81 @@
+import numpy as np
+
+# Final dealer outcomes, in table order: standing on 17..21, then bust
+DEALER_TOTALS = (17, 18, 19, 20, 21)
+BUST = len(DEALER_TOTALS)
+
+_tables = {}
+
+
+def rank_probabilities(temperature_values):
+    # probabilities.npy columns are card values 2..11 (aces counted as 11, see
+    # temperature.findProbabilities). Reorder them by rank 1..10 with rank 1 the ace.
+    temperature_values = np.asarray(temperature_values, dtype=float)
+    return np.concatenate((temperature_values[:, 9:], temperature_values[:, :9]), axis=1)
+
+
+def dealer_outcome(hard_total, has_ace, hit_soft_17=False):
+    # The dealer's final outcome index for this hand (see DEALER_TOTALS, BUST
+    # last), or None if the dealer must draw
+    soft = has_ace and hard_total + 10 <= 21
+    total = hard_total + 10 if soft else hard_total
+    if total > 21:
+        return BUST
+    if total >= DEALER_TOTALS[0] and not (hit_soft_17 and soft and total == DEALER_TOTALS[0]):
+        return DEALER_TOTALS.index(total)
+    return None
+
+
+def _dealer_distribution(probs, hard_total, has_ace, hit_soft_17, memo):
+    key = (hard_total, has_ace)
+    if key in memo:
+        return memo[key]
+
+    outcome = np.zeros(BUST + 1)
+    final = dealer_outcome(hard_total, has_ace, hit_soft_17)
+    if final is not None:
+        outcome[final] = 1.0
+    else:
+        for rank, prob in enumerate(probs, start=1):
+            if prob > 0:
+                outcome += prob * _dealer_distribution(
+                    probs, hard_total + rank, has_ace or rank == 1, hit_soft_17, memo
+                )
+
+    memo[key] = outcome
+    return outcome
+
+
+def dealer_outcome_table(temperature_values, hit_soft_17=False):
+    """Probability of the dealer finishing on 17..21 or busting.
+
+    Returns an array indexed [upcard, temperature, outcome] where upcard runs
+    1..10 (1 is the ace, index 0 is unused) and outcome follows DEALER_TOTALS
+    with BUST last. Tables are computed once per card distribution and rule
+    set and shared by every caller.
+    """
+    temperature_values = np.asarray(temperature_values, dtype=float)
+    key = (temperature_values.shape, temperature_values.tobytes(), hit_soft_17)
+    if key not in _tables:
+        rank_probs = rank_probabilities(temperature_values)
+        table = np.zeros((11, len(rank_probs), BUST + 1))
+        for temperature, probs in enumerate(rank_probs):
+            memo = {}
+            for upcard in range(1, 11):
+                table[upcard, temperature] = _dealer_distribution(
+                    probs, upcard, upcard == 1, hit_soft_17, memo
+                )
+        table.setflags(write=False)
+        _tables[key] = table
+    return _tables[key]
+
+
+def stick_values(temperature_values, hit_soft_17=False):
+    """Expected reward of sticking, indexed [player_sum, dealer_showing, temperature]."""
+    table = dealer_outcome_table(temperature_values, hit_soft_17)
+    # +1 for every dealer outcome below the player's sum (and a dealer bust),
+    # -1 for every one above it
+    player_sum = np.arange(32)[:, None]
+    totals = np.array(DEALER_TOTALS)[None, :]
+    payoff = np.hstack((np.sign(player_sum - totals), np.ones((32, 1))))
+    return np.einsum("po,dto->pdt", payoff, table)
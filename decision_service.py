@@ -0,0 +1,131 @@
+import asyncio
+import time
+import numpy as np
+
+from irl_blackjack import DeckTracker
+from policystore import open_policy
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+# Line protocol, one request per line and one reply line per request, in order:
+#   card <value>                            -> ok <temperature>
+#   shuffle                                 -> ok <temperature>
+#   decide <player_sum> <dealer_card> <usable_ace> -> <action> <temperature>
+#   temperature                             -> <temperature>
+# Actions are 0 = stick, 1 = hit as in BlackjackEnv; an ace may be sent as 1 or 11.
+# Errors reply "error <reason>". Clients may pipeline: send many lines before
+# reading any replies.
+
+
+class DecisionService:
+    """One DeckTracker and a preloaded policy table shared by every connection.
+
+    Requests are handled synchronously between socket reads, so events from
+    the vision feed and queries from the UI are applied in the order they
+    arrive and a query always sees every card dealt before it.
+    """
+
+    def __init__(self, policy_path="learnedpolicy3.npy", number=6):
+        self.tracker = DeckTracker(number)
+        self.policy = open_policy(policy_path)
+        # Copy the table out of the memory map so no query waits on a page fault
+        self.table = np.array(self.policy.table)
+        self.offsets = self.policy.offsets
+        self.dealer_ace = self.policy.metadata["dealer_ace"]
+
+    def decide(self, player_sum, dealer_card, usable_ace):
+        # Raises ValueError for a state outside the policy table
+        if not 1 <= dealer_card <= 11:
+            raise ValueError(f"dealer card {dealer_card} out of range")
+        if usable_ace not in (0, 1):
+            raise ValueError(f"usable_ace must be 0 or 1, got {usable_ace}")
+        if dealer_card in (1, 11):
+            dealer_card = self.dealer_ace
+        values = (player_sum, dealer_card, usable_ace, self.tracker.temperature)
+        index = tuple(value - offset for value, offset in zip(values, self.offsets))
+        for axis, value, position, size in zip(self.policy.axes, values, index, self.table.shape):
+            if not 0 <= position < size:
+                raise ValueError(f"{axis} {value} out of range")
+        return int(self.table[index])
+
+    def card_dealt(self, value):
+        # Raises ValueError for a card that is not a card value or not left in the shoe
+        if not 1 <= value <= 11:
+            raise ValueError(f"card {value} out of range")
+        value = 11 if value == 1 else value
+        if self.tracker.counts[value] == 0:
+            raise ValueError(f"card {value} not in shoe")
+        self.tracker.this_card_dealt(value)
+
+    def handle(self, line):
+        parts = line.split()
+        if not parts:
+            return "error empty request"
+        command = parts[0]
+        try:
+            if command == "card":
+                self.card_dealt(int(parts[1]))
+                return f"ok {self.tracker.temperature}"
+            if command == "shuffle":
+                self.tracker.reset()
+                return f"ok {self.tracker.temperature}"
+            if command == "decide":
+                if len(parts) != 4:
+                    return "error decide takes player_sum dealer_card usable_ace"
+                player_sum, dealer_card, usable_ace = (int(part) for part in parts[1:4])
+                action = self.decide(player_sum, dealer_card, usable_ace)
+                return f"{action} {self.tracker.temperature}"
+            if command == "temperature":
+                return str(self.tracker.temperature)
+        except IndexError:
+            return f"error missing arguments for {command}"
+        except ValueError as error:
+            return f"error {error}"
+        return f"error unknown command {command}"
+
+    async def connection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write((self.handle(line.decode()) + "\n").encode())
+                # Only waits when the client stops reading replies
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=HOST, port=PORT):
+        server = await asyncio.start_server(self.connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+async def measure_latency(host=HOST, port=PORT, num_requests=10000, pipeline=1):
+    # Round-trip latency of decide queries, pipeline requests in flight at a time
+    reader, writer = await asyncio.open_connection(host, port)
+    latencies = []
+    request = b"decide 16 10 0\n"
+    for _ in range(num_requests // pipeline):
+        start = time.perf_counter()
+        writer.write(request * pipeline)
+        for _ in range(pipeline):
+            await reader.readline()
+        latencies.append((time.perf_counter() - start) * 1000)
+    writer.close()
+    await writer.wait_closed()
+    latencies = np.array(latencies)
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+    }
+
+
+if __name__ == "__main__":
+    service = DecisionService()
+    print(f"Serving decisions on {HOST}:{PORT}")
+    asyncio.run(service.serve())
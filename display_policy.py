@@ -1,5 +1,5 @@
-import numpy as np
+from policystore import open_policy
 
 # Load the policy array
-best_actions = np.load("learnedpolicy2.npy")
-print(best_actions[18, 5])
+best_actions = open_policy("learnedpolicy2.npy")
+print(best_actions.lookup(18, 5))
@@ -0,0 +1,157 @@
+import json
+import time
+
+# Latency buckets are powers of two in nanoseconds: bucket i holds durations
+# in [2**(i-1), 2**i) ns, and the last bucket everything from about 1 s up
+NUM_BUCKETS = 32
+
+COUNTERS = ("hands", "steps", "hits", "dealer_draws", "cards_drawn", "reshuffles", "temperatures")
+TIMERS = ("step", "reset", "dealer")
+
+
+class LatencyHistogram:
+    """Log2-bucketed latencies; recording one costs a bit_length and an increment."""
+
+    __slots__ = ("buckets", "count", "total_ns")
+
+    def __init__(self):
+        self.buckets = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total_ns = 0
+
+    def record(self, ns):
+        self.buckets[min(ns.bit_length(), NUM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total_ns += ns
+
+    def merge(self, other):
+        for i, n in enumerate(other.buckets):
+            self.buckets[i] += n
+        self.count += other.count
+        self.total_ns += other.total_ns
+
+    def percentile(self, q):
+        # Upper edge (ns) of the bucket holding the q-th percentile, within a factor of 2
+        if not self.count:
+            return 0
+        target = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= target:
+                return 2**i
+        return 2 ** (NUM_BUCKETS - 1)
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "total_ns": self.total_ns,
+            "mean_ns": self.total_ns / self.count if self.count else 0.0,
+            "p50_ns": self.percentile(50),
+            "p99_ns": self.percentile(99),
+            "buckets": list(self.buckets),
+        }
+
+
+class EnvMetrics:
+    """Counters and latency histograms filled in by an instrumented BlackjackEnv."""
+
+    def __init__(self):
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.timers = {name: LatencyHistogram() for name in TIMERS}
+        self.started = time.perf_counter()
+
+    def merge(self, other):
+        # Combine metrics from another env, e.g. one per worker process
+        for name, value in other.counters.items():
+            self.counters[name] += value
+        for name, histogram in other.timers.items():
+            self.timers[name].merge(histogram)
+
+    def snapshot(self):
+        elapsed = time.perf_counter() - self.started
+        snapshot = {
+            "elapsed_s": elapsed,
+            "counters": dict(self.counters),
+            "timers": {name: histogram.snapshot() for name, histogram in self.timers.items()},
+        }
+        # Share of wall time spent inside each timed section (dealer play is part of step)
+        snapshot["time_share"] = {
+            name: histogram.total_ns / 1e9 / elapsed if elapsed else 0.0
+            for name, histogram in self.timers.items()
+        }
+        snapshot["hands_per_s"] = self.counters["hands"] / elapsed if elapsed else 0.0
+        return snapshot
+
+    def export(self, path):
+        with open(path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+            f.write("\n")
+
+
+def instrument(env, metrics=None):
+    """Start recording metrics for a blackjack.BlackjackEnv and return them.
+
+    Instrumentation replaces the env's and its deck's methods on the instance
+    with counting and timing versions, so an env that was never instrumented
+    (or has been uninstrumented) runs exactly the original code.
+    """
+    if metrics is None:
+        metrics = EnvMetrics()
+    uninstrument(env)
+    counters = metrics.counters
+    timers = metrics.timers
+    clock = time.perf_counter_ns
+    deck = env.deck
+    step, reset, play_dealer = env.step, env.reset, env._play_dealer
+    draw_card, deck_reset, calc_temperature = deck.draw_card, deck.reset, deck.calc_temperature
+
+    def timed_step(action):
+        start = clock()
+        counters["steps"] += 1
+        if action:
+            counters["hits"] += 1
+        result = step(action)
+        timers["step"].record(clock() - start)
+        return result
+
+    def timed_reset(*args, **kwargs):
+        start = clock()
+        counters["hands"] += 1
+        result = reset(*args, **kwargs)
+        timers["reset"].record(clock() - start)
+        return result
+
+    def timed_play_dealer():
+        start = clock()
+        cards = len(env.dealer)
+        play_dealer()
+        counters["dealer_draws"] += len(env.dealer) - cards
+        timers["dealer"].record(clock() - start)
+
+    def counted_draw_card():
+        counters["cards_drawn"] += 1
+        return draw_card()
+
+    def counted_deck_reset():
+        counters["reshuffles"] += 1
+        deck_reset()
+
+    def counted_calc_temperature():
+        counters["temperatures"] += 1
+        return calc_temperature()
+
+    env.step, env.reset, env._play_dealer = timed_step, timed_reset, timed_play_dealer
+    deck.draw_card, deck.reset = counted_draw_card, counted_deck_reset
+    deck.calc_temperature = counted_calc_temperature
+    env.metrics = metrics
+    return metrics
+
+
+def uninstrument(env):
+    # Back to the class methods; returns the metrics that were being recorded, if any
+    for name in ("step", "reset", "_play_dealer"):
+        env.__dict__.pop(name, None)
+    for name in ("draw_card", "reset", "calc_temperature"):
+        env.deck.__dict__.pop(name, None)
+    return env.__dict__.pop("metrics", None)
@@ -7,6 +7,15 @@ from gym.error import DependencyNotInstalled
 import random
 import math
 import time
+import threading
+import traceback
+from collections import deque
+
+from blackjack import CARDS, categorize, categorize_array
+
+
+# An empty shoe is about to be reshuffled, so it reads as a full one
+FULL_SHOE_AVERAGE = sum(CARDS) / len(CARDS)
 
 
 def cmp(a, b):
@@ -19,9 +28,18 @@ class DeckTracker:
         self.reset()
 
     def reset(self):
-        self.cards = [11, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10] * self.number
+        # The shoe is kept as the number of cards left of each value (indexed by
+        # value, ace as 11) plus their running total
+        self.counts = np.bincount(CARDS * self.number, minlength=12)
+        self.remaining = len(CARDS) * self.number
+        self.total = sum(CARDS) * self.number
         self.temperature = self.calc_temperature()
 
+    @property
+    def cards(self):
+        # The remaining cards as a list, e.g. for a shoe composition
+        return np.repeat(np.arange(12), self.counts).tolist()
+
     def scale_value(self, value):
         scaled_value = ((value - 6.0) / (7.8 - 6.0)) * 9
         return scaled_value
@@ -37,39 +55,52 @@ class DeckTracker:
         return result
 
     def __len__(self):
-        return len(self.cards)
+        return self.remaining
 
     def this_card_dealt(self, value):
-        try:
-            self.cards.remove(value)
-        except ValueError:
+        if 0 <= value < 12 and self.counts[value] > 0:
+            self.counts[value] -= 1
+            self.remaining -= 1
+            self.total -= value
+        else:
             print(f"Card {value} not in deck.")
         self.temperature = self.calc_temperature()
         return self.temperature
 
-    def categorize(self, value):
-        # Define the breakpoints for the categories (calculated as deciles of distribution)
-        # This approach ensures approximately equal distribution in states across categories
-        # and thus should theoretically maximize the utility of the heuristic.
-        deciles = [
-            7.14893617,
-            7.22043011,
-            7.26219512,
-            7.28911565,
-            7.30964467,
-            7.33218467,
-            7.36220472,
-            7.40425532,
-            7.47742178,
-            8.242105263157894,
-        ]
+    def cards_dealt(self, values):
+        """Deal a sequence of cards at once; returns the temperature after each card.
 
-        # Find the category for the given value
-        for i, breakpoint in enumerate(deciles):
-            if value < breakpoint:
-                return i
+        Same result as calling this_card_dealt on each value in turn.
+        """
+        values = np.asarray(values, dtype=np.intp)
+        if len(values) == 0:
+            return np.zeros(0, dtype=np.intp)
+        known = (values >= 0) & (values < 12)
+        safe = np.where(known, values, 0)
+        # A card is in the deck if fewer of its value were dealt before it in
+        # this batch than the deck held
+        onehot = np.zeros((len(values), 12), dtype=np.intp)
+        onehot[np.arange(len(values)), safe] = known
+        seen = np.cumsum(onehot, axis=0)[np.arange(len(values)), safe]
+        valid = known & (seen <= self.counts[safe])
+        for value in values[~valid]:
+            print(f"Card {value} not in deck.")
 
-        return 9  # Return the last category if value is not less than any breakpoint
+        dealt = np.where(valid, values, 0)
+        totals = self.total - np.cumsum(dealt)
+        remaining = self.remaining - np.cumsum(valid)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            averages = np.where(remaining > 0, totals / remaining, FULL_SHOE_AVERAGE)
+        temperatures = categorize_array(averages)
+
+        self.counts = self.counts - np.bincount(dealt[valid], minlength=12)
+        self.total = int(totals[-1])
+        self.remaining = int(remaining[-1])
+        self.temperature = int(temperatures[-1])
+        return temperatures
+
+    def categorize(self, value):
+        return categorize(value)
 
     def calc_temperature(self):
         avg_value = self.get_avg()
@@ -77,10 +108,9 @@ class DeckTracker:
         return temperature
 
     def get_avg(self):
-        deck_value = 0
-        for card in self.cards:
-            deck_value += card
-        return float(deck_value) / len(self)
+        if not self.remaining:
+            return FULL_SHOE_AVERAGE
+        return float(self.total) / len(self)
 
     def process_message(self, message):
         if message == "shuffle":
@@ -88,6 +118,22 @@ class DeckTracker:
         else:
             self.this_card_dealt(message)
 
+    def process_messages(self, messages):
+        # Batch form of process_message for a burst or recorded shoe; returns the
+        # temperature after each message
+        temperatures = []
+        run = []
+        for message in messages:
+            if message != "shuffle":
+                run.append(message)
+                continue
+            temperatures.extend(self.cards_dealt(run).tolist())
+            run = []
+            self.shuffle()
+            temperatures.append(self.temperature)
+        temperatures.extend(self.cards_dealt(run).tolist())
+        return temperatures
+
 
 def simulate_card_stream(deck_tracker):
     # This function would interface with your computer vision system
@@ -97,24 +143,185 @@ def simulate_card_stream(deck_tracker):
         print(f"Processed {message}, Temperature: {deck_tracker.temperature}")
 
 
-class EventDispatcher:
+BACKPRESSURE_POLICIES = ("block", "drop_oldest", "coalesce")
+
+# Most recent handler latencies kept for EventDispatcher.latency_stats
+LATENCY_SAMPLES = 10000
+
+
+class HandlerStats:
     def __init__(self):
+        self.calls = 0
+        self.dropped = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def summary(self):
+        summary = {"calls": self.calls, "dropped": self.dropped, "errors": self.errors}
+        if self.latencies:
+            samples = np.array(self.latencies) * 1000
+            summary.update(
+                mean_ms=float(samples.mean()),
+                p50_ms=float(np.percentile(samples, 50)),
+                p99_ms=float(np.percentile(samples, 99)),
+                max_ms=float(samples.max()),
+            )
+        return summary
+
+
+class EventQueue:
+    """Bounded queue of (event, handler) calls drained in order by one thread.
+
+    When the queue is full, "block" makes emit wait for room and "drop_oldest"
+    discards the oldest queued call. With "coalesce", a new event replaces the
+    pending calls of the same event type and handler (only the latest matters,
+    e.g. for a UI), and emit blocks if the queue is still full.
+    """
+
+    def __init__(self, maxsize, policy, stats):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"policy must be one of {BACKPRESSURE_POLICIES}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.stats = stats
+        self.calls = deque()
+        self.condition = threading.Condition()
+        self.unfinished = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def _drop(self, call):
+        self.unfinished -= 1
+        self.stats[call[0], call[1]].dropped += 1
+
+    def put(self, call):
+        with self.condition:
+            if self.policy == "coalesce":
+                pending = [queued for queued in self.calls if queued[:2] == call[:2]]
+                for queued in pending:
+                    self.calls.remove(queued)
+                    self._drop(queued)
+            while len(self.calls) >= self.maxsize:
+                if self.policy == "drop_oldest":
+                    self._drop(self.calls.popleft())
+                else:
+                    self.condition.wait()
+            self.calls.append(call)
+            self.unfinished += 1
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.calls and not self.closed:
+                    self.condition.wait()
+                if not self.calls:
+                    return
+                event_type, handler, args, kwargs = self.calls.popleft()
+                self.condition.notify_all()
+            stats = self.stats[event_type, handler]
+            start = time.perf_counter()
+            try:
+                handler(*args, **kwargs)
+            except Exception:
+                stats.errors += 1
+                traceback.print_exc()
+            stats.latencies.append(time.perf_counter() - start)
+            stats.calls += 1
+            with self.condition:
+                self.unfinished -= 1
+                self.condition.notify_all()
+
+    def join(self):
+        with self.condition:
+            while self.unfinished:
+                self.condition.wait()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+
+
+class EventDispatcher:
+    """Calls the handlers subscribed to an event type when it is emitted.
+
+    By default (mode="sync") emit runs every handler in the caller's thread
+    and returns the last result. With mode="queued" emit only enqueues the
+    calls and returns None; each subscriber's calls run on its own thread from
+    a bounded EventQueue, so a slow subscriber only delays itself. Methods of
+    one object (e.g. a DeckTracker's this_card_dealt and shuffle) share a
+    queue, so they see card_dealt and shuffle events in the order they were
+    emitted; pass the same queue name to subscribe to group other handlers.
+    policy is the default backpressure policy of new queues.
+    """
+
+    def __init__(self, mode="sync", maxsize=1024, policy="block"):
+        if mode not in ("sync", "queued"):
+            raise ValueError("mode must be 'sync' or 'queued'")
+        self.mode = mode
+        self.maxsize = maxsize
+        self.policy = policy
         self.handlers = {}
+        self.queues = {}
+        self.handler_queues = {}
+        self.stats = {}
 
-    def subscribe(self, event_type, handler):
+    def subscribe(self, event_type, handler, policy=None, queue=None):
         if event_type not in self.handlers:
             self.handlers[event_type] = []
         self.handlers[event_type].append(handler)
+        self.stats.setdefault((event_type, handler), HandlerStats())
+        if self.mode == "queued":
+            if queue is None:
+                queue = getattr(handler, "__self__", handler)
+            if queue not in self.queues:
+                self.queues[queue] = EventQueue(self.maxsize, policy or self.policy, self.stats)
+            self.handler_queues[handler] = self.queues[queue]
 
     def emit(self, event_type, *args, **kwargs):
+        if self.mode == "queued":
+            for handler in self.handlers.get(event_type, []):
+                self.handler_queues[handler].put((event_type, handler, args, kwargs))
+            return None
         results = []
         for handler in self.handlers.get(event_type, []):
+            stats = self.stats[event_type, handler]
+            start = time.perf_counter()
             result = handler(*args, **kwargs)
+            stats.latencies.append(time.perf_counter() - start)
+            stats.calls += 1
             if result is not None:
                 results.append(result)
         if results:
             return results[-1]  # Return the result from the last handler
 
+    def join(self):
+        # Wait until every queued event has been handled
+        for queue in self.queues.values():
+            queue.join()
+
+    def close(self):
+        self.join()
+        for queue in self.queues.values():
+            queue.close()
+
+    def latency_stats(self):
+        # One record per subscription: calls, dropped events, errors and latency in ms.
+        # owner tells apart subscribers of the same method on different objects
+        # (e.g. one DeckTracker per table).
+        return [
+            {
+                "event_type": event_type,
+                "handler": getattr(handler, "__qualname__", repr(handler)),
+                "owner": id(getattr(handler, "__self__", handler)),
+                **stats.summary(),
+            }
+            for (event_type, handler), stats in self.stats.items()
+        ]
+
 
 if __name__ == "__main__":
     deck_tracker = DeckTracker(6)
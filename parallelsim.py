@@ -0,0 +1,94 @@
+import math
+import os
+from multiprocessing import Pool
+import numpy as np
+
+
+def split_work(num_items, num_workers=None, seed=0):
+    """Divide num_items between worker processes, each with its own RNG seed.
+
+    Returns one (num_items, seed) pair per worker: at most num_items workers
+    (defaulting to the CPU count), sizes differing by at most one, and seeds
+    from independent streams spawned from seed, so the same seed and worker
+    count always split the work the same way.
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = max(1, min(num_workers, num_items))
+    streams = np.random.SeedSequence(seed).spawn(num_workers)
+    return [
+        (num_items // num_workers + (i < num_items % num_workers), int(stream.generate_state(1)[0]))
+        for i, stream in enumerate(streams)
+    ]
+
+
+def map_chunks(fn, chunks):
+    # fn over every chunk, in a process pool unless there is only one
+    if len(chunks) == 1:
+        return [fn(chunks[0])]
+    with Pool(len(chunks)) as pool:
+        return pool.map(fn, chunks)
+
+
+def _simulate_chunk(args):
+    env_fn, play_fn, policy, num_games, seed = args
+    env = env_fn()
+    # Seed once; every later env.reset() inside play_fn continues the same stream
+    env.reset(seed=seed)
+    results = {"wins": 0, "losses": 0, "draws": 0}
+    total_reward = 0.0
+    total_squared = 0.0
+
+    for _ in range(num_games):
+        reward = play_fn(env, policy)
+        if reward > 0:
+            results["wins"] += 1
+        elif reward < 0:
+            results["losses"] += 1
+        else:
+            results["draws"] += 1
+        total_reward += reward
+        total_squared += reward * reward
+
+    env.close()
+    return results, total_reward, total_squared
+
+
+def simulate_games_parallel(
+    env_fn, play_fn, policy, num_games=1000, num_workers=None, seed=0
+):
+    """Split num_games across worker processes and merge the results.
+
+    Each worker builds its own env with env_fn and plays play_fn(env, policy)
+    per game (e.g. cardcountersim.play_game_with_policy with BlackjackEnv).
+    Workers get independent RNG streams spawned from seed, so the same seed
+    and worker count always give the same results. stderr is the standard
+    error of the mean reward (nan for fewer than two games).
+    """
+    if num_games <= 0:
+        return {"wins": 0, "losses": 0, "draws": 0, "total_reward": 0.0, "stderr": math.nan}
+    chunks = [
+        (env_fn, play_fn, policy, chunk_games, chunk_seed)
+        for chunk_games, chunk_seed in split_work(num_games, num_workers, seed)
+    ]
+    outputs = map_chunks(_simulate_chunk, chunks)
+
+    results = {"wins": 0, "losses": 0, "draws": 0}
+    total_reward = 0.0
+    total_squared = 0.0
+    for chunk_results, chunk_reward, chunk_squared in outputs:
+        for key in results:
+            results[key] += chunk_results[key]
+        total_reward += chunk_reward
+        total_squared += chunk_squared
+
+    # Sample (n - 1) variance, as comparison.summarize uses; undefined for a single game
+    mean = total_reward / num_games
+    if num_games > 1:
+        variance = max((total_squared - num_games * mean * mean) / (num_games - 1), 0.0)
+        stderr = math.sqrt(variance / num_games)
+    else:
+        stderr = math.nan
+    results["total_reward"] = total_reward
+    results["stderr"] = stderr
+    return results
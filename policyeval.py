@@ -0,0 +1,132 @@
+import numpy as np
+
+from blackjack import CARDS, categorize
+from dealer import DEALER_TOTALS, dealer_outcome_table, rank_probabilities
+from stateindex import encode
+
+# Card distribution of a full shoe, in probabilities.npy layout (card values 2..11)
+UNIFORM = np.array([[1, 1, 1, 1, 1, 1, 1, 1, 4, 1]]) / 13.0
+
+# Temperature of a full shoe, used to pick the policy's temperature slice for UNIFORM
+FULL_SHOE_TEMPERATURE = categorize(sum(CARDS) / len(CARDS))
+
+
+def evaluate_policy(policy, temperature_values=None, temperature=None, rules=None):
+    """Exact expected reward and win/push/loss probabilities of a policy table.
+
+    Cards are drawn from an infinite shoe with the given distribution, the
+    same model ValueIterationAgent is solved under: temperature_values rows
+    are card probabilities in probabilities.npy layout (None for a full shoe).
+    Every row is evaluated at once, playing the policy's slice for that row's
+    temperature; temperature picks a single row instead (or, for the full
+    shoe, which slice of the policy to play). rules defaults to the rules the
+    policy was saved with.
+
+    Returns a dict of "ev", "win", "push" and "loss", each an array over the
+    evaluated temperatures (a float when a single one was asked for).
+    """
+    if rules is None:
+        rules = policy.metadata["rules"]
+    if temperature_values is None:
+        temperature_values = UNIFORM
+        temperatures = np.array([FULL_SHOE_TEMPERATURE if temperature is None else temperature])
+    else:
+        temperature_values = np.asarray(temperature_values, dtype=float)
+        if temperature is None:
+            temperatures = np.arange(len(temperature_values))
+        else:
+            temperature_values = temperature_values[temperature : temperature + 1]
+            temperatures = np.array([temperature])
+
+    flat_policy = policy.flat()
+    probs = rank_probabilities(temperature_values)  # [temperature, rank - 1], ace first
+    dealer = dealer_outcome_table(temperature_values, rules.get("hit_soft_17", False))[1:]
+    dealer = np.swapaxes(dealer, 0, 1)  # [temperature, upcard - 1, outcome]
+    upcards = np.arange(1, 11)[None, :]
+    temperatures = temperatures[:, None]
+    shape = (len(temperatures), 10)
+
+    # Hands still being played, by hard total (aces as 1) and whether they hold an ace;
+    # hard totals only grow, so each is settled before any hand can reach it again
+    mass = np.zeros((22, 2) + shape)
+    for first in range(1, 11):
+        for second in range(1, 11):
+            if sorted((first, second)) != [1, 10]:
+                mass[first + second, int(first == 1 or second == 1)] += (
+                    probs[:, first - 1] * probs[:, second - 1]
+                )[:, None]
+    natural = 2 * probs[:, 0] * probs[:, 9]
+    stood = np.zeros((22,) + shape)
+    win = np.zeros(shape)
+    push = np.zeros(shape)
+    payout = np.zeros(shape)
+
+    # A natural plays as a soft 21 but can earn a bonus if the player stands on it
+    hit_natural = flat_policy[encode(21, upcards, 1, temperatures)] == 1
+    natural_stand = np.where(hit_natural, 0.0, natural[:, None])
+    dealer_21 = dealer[:, :, DEALER_TOTALS.index(21)]
+    if rules.get("sab", False):
+        # Wins unless the dealer also has a natural
+        dealer_natural = np.zeros(shape)
+        dealer_natural[:, 0] = probs[:, 9]
+        dealer_natural[:, 9] = probs[:, 0]
+        win += natural_stand * (1 - dealer_natural)
+        push += natural_stand * dealer_natural
+        payout += natural_stand * (1 - dealer_natural)
+    elif rules.get("natural", False):
+        win += natural_stand * (1 - dealer_21)
+        push += natural_stand * dealer_21
+        payout += 1.5 * natural_stand * (1 - dealer_21)
+    else:
+        stood[21] += natural_stand
+    mass[11, 1] += np.where(hit_natural, natural[:, None], 0.0)
+
+    for hard_total in range(2, 22):
+        for has_ace in (0, 1):
+            current = mass[hard_total, has_ace]
+            if not current.any():
+                continue
+            usable = int(has_ace and hard_total + 10 <= 21)
+            player_sum = hard_total + 10 * usable
+            hit = flat_policy[encode(player_sum, upcards, usable, temperatures)] == 1
+            stood[player_sum] += np.where(hit, 0.0, current)
+            hitting = np.where(hit, current, 0.0)
+            for rank in range(1, 11):
+                drawn = hitting * probs[:, rank - 1][:, None]
+                if hard_total + rank <= 21:
+                    mass[hard_total + rank, int(has_ace or rank == 1)] += drawn
+
+    # Standing hands against the dealer's final total
+    totals = np.arange(22)[:, None]
+    beats = np.hstack((totals > np.array(DEALER_TOTALS)[None, :], np.ones((22, 1), dtype=bool)))
+    ties = np.hstack((totals == np.array(DEALER_TOTALS)[None, :], np.zeros((22, 1), dtype=bool)))
+    stood_win = np.einsum("ptd,po,tdo->td", stood, beats, dealer)
+    stood_push = np.einsum("ptd,po,tdo->td", stood, ties, dealer)
+    win += stood_win
+    push += stood_push
+    payout += stood_win
+
+    # Weight by the dealer's upcard; busted hands make up the rest of the losses
+    win = (win * probs).sum(axis=1)
+    push = (push * probs).sum(axis=1)
+    payout = (payout * probs).sum(axis=1)
+    loss = 1.0 - win - push
+    results = {"ev": payout - loss, "win": win, "push": push, "loss": loss}
+    if len(temperatures) == 1 and (temperature is not None or len(temperature_values) == 1):
+        results = {key: float(value[0]) for key, value in results.items()}
+    return results
+
+
+if __name__ == "__main__":
+    from policystore import open_policy
+
+    temperature_values = np.load("probabilities.npy")
+    for path in ("learnedpolicy2.npy", "learnedpolicy3.npy"):
+        results = evaluate_policy(open_policy(path), temperature_values)
+        print(f"{path}: full shoe {evaluate_policy(open_policy(path))}")
+        for temperature in range(len(temperature_values)):
+            print(
+                f"  temperature {temperature}: EV {results['ev'][temperature]:+.5f} "
+                f"win {results['win'][temperature]:.4f} push {results['push'][temperature]:.4f} "
+                f"loss {results['loss'][temperature]:.4f}"
+            )
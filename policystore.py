@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+from stateindex import NUM_STATES, all_states
+
+FORMAT_VERSION = 1
+
+# Axis names and index offsets (value stored at index 0) of the tables this repo writes
+TEMPERATURE_AXES = ["player_sum", "dealer_card", "usable_ace", "temperature"]
+BASIC_AXES = ["player_sum", "dealer_card", "usable_ace"]
+
+# Rules of blackjack.BlackjackEnv with its defaults
+DEFAULT_RULES = {"natural": False, "sab": False, "hit_soft_17": False}
+
+
+def calibration_hash(temperature_values):
+    # Identifies the card distribution (e.g. probabilities.npy) a policy was solved against
+    data = np.ascontiguousarray(temperature_values, dtype=float).tobytes()
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def metadata_path(path):
+    return os.path.splitext(path)[0] + ".json"
+
+
+def save_policy(
+    path,
+    table,
+    axes,
+    offsets,
+    rules=DEFAULT_RULES,
+    number=None,
+    calibration=None,
+    dealer_ace=1,
+    source=None,
+):
+    """Write a policy table as .npy with a .json record of its layout.
+
+    offsets[i] is the value stored at index 0 of axis i (index = value -
+    offset), number the deck count the policy was solved for (None for an
+    infinite deck) and dealer_ace the value the dealer card axis uses for an
+    ace. calibration is a calibration_hash of the card distribution used and
+    source a short note of what produced the table.
+    """
+    table = np.asarray(table)
+    if len(axes) != table.ndim or len(offsets) != table.ndim:
+        raise ValueError("axes and offsets must name every axis of the table")
+    metadata = {
+        "format_version": FORMAT_VERSION,
+        "shape": list(table.shape),
+        "dtype": table.dtype.str,
+        "axes": list(axes),
+        "offsets": [int(offset) for offset in offsets],
+        "dealer_ace": dealer_ace,
+        "rules": dict(rules),
+        "number": number,
+        "calibration": calibration,
+        "source": source,
+    }
+    np.save(path, table)
+    with open(metadata_path(path), "w") as f:
+        json.dump(metadata, f, indent=2)
+        f.write("\n")
+
+
+class PolicyTable:
+    """A policy table opened read-only and memory-mapped on first use.
+
+    Lookups take state values as the env reports them (player sum, dealer
+    card, usable ace, temperature) and apply the offsets recorded with the
+    table, so callers never index the raw array by hand. Pickling keeps only
+    the path, so worker processes map the same file instead of copying it.
+
+    flat() lays the table out by stateindex.encode, so a lookup is a single
+    read: policy.flat()[state_index], for one state or a whole batch.
+    """
+
+    def __init__(self, path, metadata):
+        self.path = path
+        self.metadata = metadata
+        self.axes = metadata["axes"]
+        self.offsets = metadata["offsets"]
+        self._table = None
+        self._flat = None
+
+    @property
+    def table(self):
+        if self._table is None:
+            self._table = np.load(self.path, mmap_mode="r")
+            if list(self._table.shape) != self.metadata["shape"]:
+                raise ValueError(f"{self.path} does not match its recorded shape")
+        return self._table
+
+    def index(self, *values):
+        # Array indices for the leading axes, from env values (works on NumPy arrays too)
+        indices = []
+        for axis, offset, value in zip(self.axes, self.offsets, values):
+            if axis == "dealer_card" and self.metadata["dealer_ace"] != 11:
+                # BlackjackEnv reports a dealer ace as 11
+                value = np.where(value == 11, self.metadata["dealer_ace"], value)
+            indices.append(np.asarray(value).astype(np.intp) - offset)
+        return tuple(indices)
+
+    def lookup(self, *values):
+        return self.table[self.index(*values)]
+
+    def flat(self):
+        # The table over every stateindex state; axes the table lacks (e.g.
+        # temperature for a basic strategy) are broadcast and states outside it are 0
+        if self._flat is None:
+            player_sum, dealer_card, usable_ace, temperature = all_states()
+            states = {
+                "player_sum": player_sum,
+                "dealer_card": np.where(dealer_card == 1, 11, dealer_card),
+                "usable_ace": usable_ace,
+                "temperature": temperature,
+            }
+            if not set(self.axes) <= set(states):
+                raise ValueError(f"{self.path} has axes that are not state values")
+            indices = self.index(*(states[axis] for axis in self.axes))
+            valid = np.ones(NUM_STATES, dtype=bool)
+            for index, size in zip(indices, self.table.shape):
+                valid &= (index >= 0) & (index < size)
+            flat = np.zeros(NUM_STATES, dtype=self.table.dtype)
+            flat[valid] = self.table[tuple(index[valid] for index in indices)]
+            self._flat = flat
+        return self._flat
+
+    def __getstate__(self):
+        return {"path": self.path, "metadata": self.metadata}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["metadata"])
+
+
+def open_policy(path):
+    with open(metadata_path(path)) as f:
+        metadata = json.load(f)
+    if metadata["format_version"] > FORMAT_VERSION:
+        raise ValueError(
+            f"{path} uses policy format {metadata['format_version']}, "
+            f"newer than the supported {FORMAT_VERSION}"
+        )
+    return PolicyTable(path, metadata)
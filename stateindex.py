@@ -0,0 +1,29 @@
+import numpy as np
+
+# Dense state layout, outermost axis first. Dealer cards are stored 1..10 with
+# an ace as 1 (BlackjackEnv deals it as 11; both are accepted).
+PLAYER_SUMS = 32
+DEALER_CARDS = 10
+USABLE_ACE = 2
+TEMPERATURES = 10
+NUM_STATES = PLAYER_SUMS * DEALER_CARDS * USABLE_ACE * TEMPERATURES
+
+
+def encode(player_sum, dealer_card, usable_ace, temperature):
+    """Dense index of a state; takes Python ints or NumPy arrays of any shape."""
+    dealer = dealer_card - 10 * (dealer_card == 11) - 1
+    return ((player_sum * DEALER_CARDS + dealer) * USABLE_ACE + usable_ace) * TEMPERATURES + temperature
+
+
+def decode(index):
+    # (player_sum, dealer_card, usable_ace, temperature), dealer ace as 1
+    index = np.asarray(index)
+    rest, temperature = np.divmod(index, TEMPERATURES)
+    rest, usable_ace = np.divmod(rest, USABLE_ACE)
+    player_sum, dealer = np.divmod(rest, DEALER_CARDS)
+    return player_sum, dealer + 1, usable_ace, temperature
+
+
+def all_states():
+    # Every state in index order, as four arrays
+    return decode(np.arange(NUM_STATES))
@@ -1,8 +1,9 @@
-import random
 import gym
 import numpy as np
 import math
+import os
 import sys
+from blackjack import ShoePool, categorize, categorize_array
 
 print("running")
 
@@ -23,31 +24,50 @@ ranks = {
 }
 
 
-class Card:
-    def __init__(self, value):
-        self.value = value
+# Number of shoes shuffled together each time a simulation's pool runs out
+SHOE_POOL_SIZE = 256
 
+# Treat ace as 11 (not one) in temperature calculations
+CARD_VALUES = [value[1] if isinstance(value, tuple) else value for value in ranks.values()]
 
+
+# Cards are plain int values (ace as 11) rather than Card objects: deal() and
+# peek() return the value and add_to_bottom() takes one
 class Deck:
-    def __init__(self, number_decks=1):
-        self.cards = []
-        for i in range(number_decks):
-            for i in range(4):
-                for rank, value in ranks.items():
-                    self.cards.append(Card(value))
+    def __init__(self, number_decks=1, np_random=None, pool_size=1):
+        if np_random is None:
+            np_random = np.random.RandomState()
+        self.np_random = np_random
+        self.pool = ShoePool(np_random, CARD_VALUES * 4 * number_decks, pool_size)
+        self.reset()
+
+    def reset(self):
+        # Take the next pre-shuffled shoe from the pool; dealing only advances the cursor
+        self.cards = self.pool.next()
+        self.cursor = 0
+        # Running shoe statistics, kept up to date as cards are dealt and returned
+        self.total = self.pool.total
+        self.counts = list(self.pool.counts)
 
     def shuffle(self):
-        random.shuffle(self.cards)
+        self.np_random.shuffle(self.cards[self.cursor :])
 
     def deal(self):
-        return self.cards.pop(0)
+        card = int(self.cards[self.cursor])
+        self.cursor += 1
+        self.total -= card
+        self.counts[card] -= 1
+        return card
 
     def peek(self):
-        if len(self.cards) > 0:
-            return self.cards[0]
+        if len(self) > 0:
+            return int(self.cards[self.cursor])
 
     def add_to_bottom(self, card):
-        self.cards.append(card)
+        self.cards = np.append(self.cards[self.cursor :], np.int8(card))
+        self.cursor = 0
+        self.total += card
+        self.counts[card] += 1
 
     """
     Found via simulation:
@@ -58,28 +78,7 @@ class Deck:
     """
 
     def categorize(self, value):
-        # Define the breakpoints for the categories (calculated as deciles of distribution)
-        # This approach ensures approximately equal distribution in states across categories
-        # and thus should theoretically maximize the utility of the heuristic.
-        deciles = [
-            7.14893617,
-            7.22043011,
-            7.26219512,
-            7.28911565,
-            7.30964467,
-            7.33218467,
-            7.36220472,
-            7.40425532,
-            7.47742178,
-            8.242105263157894,
-        ]
-
-        # Find the category for the given value
-        for i, breakpoint in enumerate(deciles):
-            if value < breakpoint:
-                return i
-
-        return 9  # Return the last category if value is not less than any breakpoint
+        return categorize(value)
 
     def calc_temperature(self):
         avg_value = self.get_avg()
@@ -88,99 +87,186 @@ class Deck:
         return temperature
 
     def get_avg(self):
-        deck_value = 0
-        for card in self.cards:
-            if isinstance(card.value, tuple):
-                # Treat ace as 11 (not one) in temperature calculations
-                _, value = card.value
-            else:
-                # Take the value as is
-                value = card.value
-            deck_value += value
-        return float(deck_value) / len(self)
+        return float(self.total) / len(self)
 
     def __str__(self):
         result = ""
-        for card in self.cards:
+        for card in self.cards[self.cursor :]:
             result += str(card) + "\n"
         return result
 
     def __len__(self):
-        return len(self.cards)
+        return len(self.cards) - self.cursor
+
+
+def shoe_trajectories(
+    num_simulations, draws_between_shuffle, num_decks=6, np_random=None
+):
+    """Deal num_simulations cards from consecutive shuffled shoes, many shoes at a time.
+
+    Each shoe is dealt draws_between_shuffle + 1 cards before the next shuffle,
+    as in the original one-card-at-a-time loop. Yields (totals, remaining,
+    cards) per batch of shoes: the total value and number of cards left in the
+    shoe just before each deal (their ratio is the shoe average) and the card
+    dealt.
+    """
+    if np_random is None:
+        np_random = np.random.RandomState()
+    pool = ShoePool(np_random, CARD_VALUES * 4 * num_decks, SHOE_POOL_SIZE)
+    shoe_size = len(pool.cards)
+    draws_per_shoe = draws_between_shuffle + 1
+    if draws_per_shoe > shoe_size:
+        raise ValueError("draws_between_shuffle must be less than the shoe size")
+
+    remaining = np.arange(
+        shoe_size, shoe_size - draws_per_shoe, -1, dtype=np.int32
+    )
+    remaining = np.broadcast_to(remaining, (SHOE_POOL_SIZE, draws_per_shoe)).ravel()
+    draws = 0
+    while draws < num_simulations:
+        pool.refill()
+        shoes = pool.buffers[:, :draws_per_shoe]
+        # Total of the cards dealt before each draw, from the running sum of every shoe
+        dealt = np.cumsum(shoes, axis=1, dtype=np.int32) - shoes
+        totals = pool.total - dealt
+        take = min(num_simulations - draws, shoes.size)
+        draws += take
+        yield totals.ravel()[:take], remaining[:take], shoes.ravel()[:take]
+
+
+class AverageHistogram:
+    """Exact streaming histogram of shoe averages, for quantiles in fixed memory.
+
+    A shoe average is always (total value left) / (cards left), so counting
+    every (total, cards left) pair keeps the full distribution in a table
+    whose size depends only on the shoe size, however many samples are added.
+    Histograms built by separate workers can be merged, and saved to resume
+    a run later.
+    """
 
+    def __init__(self, num_decks=6):
+        shoe_size = len(CARD_VALUES) * 4 * num_decks
+        self.num_decks = num_decks
+        self.counts = np.zeros(
+            (max(CARD_VALUES) * shoe_size + 1, shoe_size + 1), dtype=np.int64
+        )
+        self.draws = 0
 
-def main(sim_name, num_simulations):
-    num_decks = 6
-    shuffle_at = 0.7
+    def update(self, totals, remaining):
+        index = np.ravel_multi_index((totals, remaining), self.counts.shape)
+        self.counts += np.bincount(index, minlength=self.counts.size).reshape(
+            self.counts.shape
+        )
+        self.draws += len(totals)
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.draws += other.draws
+
+    def save(self, path):
+        # Through a file handle, so np.savez writes to path as given instead of
+        # appending .npz (findRange checks for exactly this path to resume)
+        with open(path, "wb") as f:
+            np.savez(f, counts=self.counts, draws=self.draws, num_decks=self.num_decks)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        histogram = cls(int(data["num_decks"]))
+        histogram.counts[:] = data["counts"]
+        histogram.draws = int(data["draws"])
+        return histogram
+
+    def _values(self):
+        # Distinct averages in increasing order with how often each was seen
+        totals, remaining = np.nonzero(self.counts)
+        values = totals / remaining
+        order = np.argsort(values, kind="stable")
+        return values[order], self.counts[totals, remaining][order]
+
+    def percentile(self, q):
+        # Same as np.percentile (linear interpolation) over every sample added
+        values, counts = self._values()
+        position = np.asarray(q, dtype=float) / 100 * (counts.sum() - 1)
+        cumulative = np.cumsum(counts)
+        lower = np.floor(position).astype(np.int64)
+        below = values[np.searchsorted(cumulative, lower, side="right")]
+        upper = np.searchsorted(cumulative, lower + 1, side="right")
+        above = values[np.minimum(upper, len(values) - 1)]
+        return below + (position - lower) * (above - below)
+
+    def min(self):
+        return self._values()[0][0]
+
+    def max(self):
+        return self._values()[0][-1]
+
+
+def main(sim_name, num_simulations, num_decks=6, shuffle_at=0.7):
     draws_between_shuffle = math.floor(num_decks * 52 * shuffle_at)
     if sim_name == "FindRange":
-        findRange(num_simulations, draws_between_shuffle)
+        findRange(num_simulations, draws_between_shuffle, num_decks)
     if sim_name == "FindProbabilities":
-        findProbabilities(num_simulations, draws_between_shuffle)
+        findProbabilities(num_simulations, draws_between_shuffle, num_decks)
+
+
+def _report_progress(draws, num_simulations):
+    # Calculate completion percentage
+    completion_percentage = (draws / num_simulations) * 100
+    sys.stdout.write(f"\r{completion_percentage:.2f}% complete")
+    sys.stdout.flush()
 
 
 # Min: ~ 6.354166666666667 Max: ~ 8.242105263157894
-def findRange(num_simulations, draws_between_shuffle):
-    deck = Deck(number_decks=6)
-    deck.shuffle()
-    values = []
-    index = 0
-
-    for i in range(num_simulations):
-        if i % 7000 == 0:
-            # Calculate completion percentage
-            completion_percentage = (i / num_simulations) * 100
-            sys.stdout.write(f"\r{completion_percentage:.2f}% complete")
-            sys.stdout.flush()
-
-        avg_value = deck.get_avg()
-        values.append(avg_value)
-
-        card = deck.deal()
-        index += 1
-        if index > draws_between_shuffle:
-            deck = Deck(number_decks=6)
-            deck.shuffle()
-            index = 0
+def findRange(
+    num_simulations,
+    draws_between_shuffle,
+    num_decks=6,
+    checkpoint=None,
+    checkpoint_every=10000000,
+):
+    # With a checkpoint path, progress is saved every checkpoint_every draws and
+    # at the end, and a rerun with the same path resumes where the last one stopped
+    if checkpoint is not None and os.path.exists(checkpoint):
+        histogram = AverageHistogram.load(checkpoint)
+    else:
+        histogram = AverageHistogram(num_decks)
+    saved = histogram.draws
+
+    for totals, remaining, _ in shoe_trajectories(
+        num_simulations - histogram.draws, draws_between_shuffle, num_decks
+    ):
+        histogram.update(totals, remaining)
+        if checkpoint is not None and (
+            histogram.draws - saved >= checkpoint_every
+            or histogram.draws >= num_simulations
+        ):
+            histogram.save(checkpoint)
+            saved = histogram.draws
+        _report_progress(histogram.draws, num_simulations)
 
     # Calculate deciles
-    deciles = np.percentile(values, np.arange(10, 100, 10))
+    deciles = histogram.percentile(np.arange(10, 100, 10))
     print("Deciles:", deciles)
-    print("Min:", min(values), "Max:", max(values))
+    print("Min:", histogram.min(), "Max:", histogram.max())
 
-    return deciles, min(values), max(values)
+    return deciles, histogram.min(), histogram.max()
 
 
-def findProbabilities(num_simulations, draws_between_shuffle):
-    deck = Deck(number_decks=6)
-    deck.shuffle()
-
+def findProbabilities(num_simulations, draws_between_shuffle, num_decks=6, np_random=None):
     count = np.zeros((10, 10))
-    index = 0
-
-    temp_count = np.zeros(10)  # Array to track the count of each temperature
-
-    for i in range(num_simulations):
-        if i % 7000 == 0:
-            completion_percentage = (i / num_simulations) * 100
-            sys.stdout.write(f"\r{completion_percentage:.2f}% complete")
-            sys.stdout.flush()
-
-        temp = deck.calc_temperature()
-        temp_count[temp] += 1  # Increment the count for the current temperature
-        card = deck.deal()
-        if isinstance(card.value, tuple):
-            _, value = card.value
-        else:
-            value = card.value
-        # Adjust indices based on the actual ranges
-        count[temp][value - 2] += 1
-        index += 1
-        if index > draws_between_shuffle:
-            deck = Deck(number_decks=6)
-            deck.shuffle()
-            index = 0
-
+    draws = 0
+
+    for totals, remaining, cards in shoe_trajectories(
+        num_simulations, draws_between_shuffle, num_decks, np_random
+    ):
+        temps = categorize_array(totals / remaining)
+        # Tally (temperature, card value) pairs; card values 2..11 map to columns 0..9
+        count += np.bincount(temps * 10 + cards - 2, minlength=100).reshape(10, 10)
+        draws += len(cards)
+        _report_progress(draws, num_simulations)
+
+    temp_count = count.sum(axis=1)  # Array to track the count of each temperature
     probabilities = np.zeros((10, 10))
 
     for i in range(10):
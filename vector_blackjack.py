@@ -0,0 +1,202 @@
+from typing import Optional
+import numpy as np
+import gym
+from gym import spaces
+
+from blackjack import CARDS, categorize_array
+from stateindex import encode
+
+# Distinct card values in the shoe and how many of each one "deck" holds
+RANK_VALUES, RANK_COUNTS = np.unique(CARDS, return_counts=True)
+
+
+class VectorBlackjackEnv(gym.vector.VectorEnv):
+    """N independent BlackjackEnv tables stepped together as NumPy arrays.
+
+    Every table follows the same rules as blackjack.BlackjackEnv: each hand is
+    dealt from a freshly shuffled shoe of `number` decks, the dealer draws
+    until sum_hand reaches 17, and `natural`/`sab` pay out the same way.
+    Observations are a tuple of arrays (player_sum, dealer_card, usable_ace,
+    temperature). Finished tables are reset automatically; the observation
+    they ended on is returned in info["final_observation"], an object array
+    holding each finished table's observation tuple (None for the others)
+    masked by info["_final_observation"].
+    """
+
+    def __init__(self, num_envs, natural=False, sab=False, number=6):
+        single_observation_space = spaces.Tuple(
+            (
+                spaces.Discrete(32),
+                spaces.Discrete(11),
+                spaces.Discrete(2),
+                spaces.Discrete(10),
+            )
+        )
+        super().__init__(num_envs, single_observation_space, spaces.Discrete(2))
+        self.np_random = np.random.RandomState()
+        self.number = number
+        self.natural = natural
+        self.sab = sab
+
+        # Shoe state: remaining cards of each rank per table
+        self.counts = np.zeros((num_envs, len(RANK_VALUES)), dtype=np.int16)
+        self.remaining = np.zeros(num_envs, dtype=np.int32)
+        self.total = np.zeros(num_envs, dtype=np.int32)
+
+        # Hands are kept as (hard sum, holds a 1, number of cards)
+        self.player_sum = np.zeros(num_envs, dtype=np.int32)
+        self.player_one = np.zeros(num_envs, dtype=bool)
+        self.player_cards = np.zeros(num_envs, dtype=np.int32)
+        self.dealer_sum = np.zeros(num_envs, dtype=np.int32)
+        self.dealer_one = np.zeros(num_envs, dtype=bool)
+        self.dealer_cards = np.zeros(num_envs, dtype=np.int32)
+        self.dealer_first = np.zeros(num_envs, dtype=np.int32)
+
+    def _draw(self, idx):
+        # Sample one card without replacement from each selected table's shoe
+        counts = self.counts[idx]
+        u = (self.np_random.random_sample(len(idx)) * self.remaining[idx]).astype(
+            np.int32
+        )
+        rank = (np.cumsum(counts, axis=1) <= u[:, None]).sum(axis=1)
+        self.counts[idx, rank] -= 1
+        self.remaining[idx] -= 1
+        value = RANK_VALUES[rank]
+        self.total[idx] -= value
+        return value
+
+    def _hit_player(self, idx):
+        card = self._draw(idx)
+        self.player_sum[idx] += card
+        self.player_one[idx] |= card == 1
+        self.player_cards[idx] += 1
+
+    def _hit_dealer(self, idx):
+        card = self._draw(idx)
+        self.dealer_sum[idx] += card
+        self.dealer_one[idx] |= card == 1
+        self.dealer_cards[idx] += 1
+        return card
+
+    def _deal(self, idx):
+        self.counts[idx] = RANK_COUNTS * self.number
+        self.remaining[idx] = len(CARDS) * self.number
+        self.total[idx] = sum(CARDS) * self.number
+        self.player_sum[idx] = 0
+        self.player_one[idx] = False
+        self.player_cards[idx] = 0
+        self.dealer_sum[idx] = 0
+        self.dealer_one[idx] = False
+        self.dealer_cards[idx] = 0
+        # Same order as BlackjackEnv.reset: dealer hand first, then player hand
+        self.dealer_first[idx] = self._hit_dealer(idx)
+        self._hit_dealer(idx)
+        self._hit_player(idx)
+        self._hit_player(idx)
+
+    def _usable_ace(self, hand_sum, has_one):
+        return has_one & (hand_sum + 10 <= 21)
+
+    def _sum_hand(self, hand_sum, has_one):
+        return hand_sum + 10 * self._usable_ace(hand_sum, has_one)
+
+    def _is_natural(self, hand_sum, has_one, cards):
+        return (cards == 2) & has_one & (hand_sum == 11)
+
+    def _temperature(self):
+        avg_value = self.total / self.remaining
+        return categorize_array(avg_value)
+
+    def _get_obs(self):
+        return (
+            self._sum_hand(self.player_sum, self.player_one),
+            self.dealer_first.copy(),
+            self._usable_ace(self.player_sum, self.player_one).astype(np.int8),
+            self._temperature(),
+        )
+
+    def reset(self, seed: Optional[int] = None, options: Optional[dict] = None):
+        if seed is not None:
+            self.np_random = np.random.RandomState(seed)
+        self._deal(np.arange(self.num_envs))
+        return self._get_obs(), {}
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        rewards = np.zeros(self.num_envs)
+        terminated = np.zeros(self.num_envs, dtype=bool)
+
+        hit = np.flatnonzero(actions)
+        if len(hit):
+            self._hit_player(hit)
+            bust = hit[self._sum_hand(self.player_sum[hit], self.player_one[hit]) > 21]
+            terminated[bust] = True
+            rewards[bust] = -1.0
+
+        stick = np.flatnonzero(actions == 0)
+        if len(stick):
+            terminated[stick] = True
+            drawing = stick
+            while True:
+                dealer = self._sum_hand(self.dealer_sum[drawing], self.dealer_one[drawing])
+                drawing = drawing[dealer < 17]
+                if not len(drawing):
+                    break
+                self._hit_dealer(drawing)
+
+            player = self._sum_hand(self.player_sum[stick], self.player_one[stick])
+            dealer = self._sum_hand(self.dealer_sum[stick], self.dealer_one[stick])
+            player = np.where(player > 21, 0, player)
+            dealer = np.where(dealer > 21, 0, dealer)
+            reward = np.sign(player - dealer).astype(float)
+
+            player_natural = self._is_natural(
+                self.player_sum[stick], self.player_one[stick], self.player_cards[stick]
+            )
+            if self.sab:
+                dealer_natural = self._is_natural(
+                    self.dealer_sum[stick],
+                    self.dealer_one[stick],
+                    self.dealer_cards[stick],
+                )
+                reward[player_natural & ~dealer_natural] = 1.0
+            elif self.natural:
+                reward[player_natural & (reward == 1.0)] = 1.5
+            rewards[stick] = reward
+
+        observation = self._get_obs()
+        truncated = np.zeros(self.num_envs, dtype=bool)
+        infos = {}
+        done = np.flatnonzero(terminated)
+        if len(done):
+            # As gym's vector envs do: one entry per table, None where it didn't finish
+            final_observation = np.full(self.num_envs, None, dtype=object)
+            for i in done:
+                final_observation[i] = tuple(int(part[i]) for part in observation)
+            infos["final_observation"] = final_observation
+            infos["_final_observation"] = terminated.copy()
+            self._deal(done)
+            observation = self._get_obs()
+        return observation, rewards, terminated, truncated, infos
+
+
+def simulate_games(policy, num_games=1000000, num_envs=4096, seed=None):
+    # Same tally as cardcountersim.simulate_games for a policystore.PolicyTable,
+    # num_envs hands at a time
+    flat_policy = policy.flat()
+    env = VectorBlackjackEnv(num_envs)
+    observation, _ = env.reset(seed=seed)
+    results = {"wins": 0, "losses": 0, "draws": 0}
+    played = 0
+
+    while played < num_games:
+        player_sum, dealer_card, usable_ace, temperature = observation
+        actions = flat_policy[encode(player_sum, dealer_card, usable_ace, temperature)]
+        observation, rewards, terminated, _, _ = env.step(actions)
+        rewards = rewards[terminated][: num_games - played]
+        results["wins"] += int(np.sum(rewards > 0))
+        results["losses"] += int(np.sum(rewards < 0))
+        results["draws"] += int(np.sum(rewards == 0))
+        played += len(rewards)
+
+    return results